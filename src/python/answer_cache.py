@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import time
+
+import numpy as np
+
+# Words that name something precisely: numbers, snake_case and camelCase identifiers
+IDENTIFIER_PATTERN = re.compile(r'\b\w*(?:\d|_|[a-z][A-Z])\w*\b')
+
+
+class AnswerCache():
+    """
+    Semantic cache of LLM answers, keyed by the query embedding and the version of the vector database.
+
+    A query is a hit when a cached query with the same search filter has a cosine similarity of at least
+    threshold with it and mentions the same identifiers and numbers (questions that only differ in one
+    of them embed almost identically). Entries expire ttl seconds after they were stored, and the least
+    recently used entries are evicted beyond max_entries. All entries are dropped when the vector
+    database changes. The query vectors are stored in vectors.npy and the entries in entries.json,
+    one folder per embedding model.
+    """
+    VECTORS_FILE = 'vectors.npy'
+    ENTRIES_FILE = 'entries.json'
+
+    def __init__(self, cache_dir, model_name, threshold=0.95, ttl=86400, max_entries=1000):
+        self.cache_path = os.path.join(cache_dir, re.sub(r'[^a-zA-Z0-9_.-]+', '_', model_name))
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+
+        self.index_version = None
+        self.entries = []
+        self.vectors = None
+
+        entries_path = os.path.join(self.cache_path, self.ENTRIES_FILE)
+        if os.path.exists(entries_path):
+            with open(entries_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            vectors_path = os.path.join(self.cache_path, self.VECTORS_FILE)
+            vectors = np.load(vectors_path) if os.path.exists(vectors_path) else None
+            # Skip a cache whose files were not saved together
+            if data['entries'] and vectors is not None and len(vectors) == len(data['entries']):
+                self.index_version = data['index_version']
+                self.entries = data['entries']
+                self.vectors = vectors
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    @staticmethod
+    def get_identifiers(user_query):
+        return set(IDENTIFIER_PATTERN.findall(user_query))
+
+    def set_index_version(self, index_version):
+        # Answers were generated from the chunks of another vector database, drop them
+        if index_version != self.index_version:
+            if self.entries:
+                print("Vector database changed, clearing the answer cache.")
+            self.index_version = index_version
+            self.entries = []
+            self.vectors = None
+
+    def get(self, query_vector, user_query, search_filter=None):
+        """
+        Returns (dict): The cached entry most similar to the query, or None.
+        The entry holds the query, the answer, the similarity and the duration of the original query.
+        """
+        self.expire()
+        filter_key = json.dumps(search_filter, sort_keys=True)
+        identifiers = self.get_identifiers(user_query)
+        best_entry, best_similarity = None, self.threshold
+        if self.entries:
+            similarities = self.vectors @ self.normalize(query_vector)
+            for row in np.flatnonzero(similarities >= self.threshold):
+                entry = self.entries[row]
+                if entry['filter'] == filter_key and similarities[row] >= best_similarity and self.get_identifiers(entry['query']) == identifiers:
+                    best_entry, best_similarity = entry, float(similarities[row])
+
+        if best_entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.time_saved += best_entry['duration']
+        best_entry['last_used'] = time.time()
+        return dict(best_entry, similarity=best_similarity)
+
+    def put(self, query_vector, user_query, answer, duration, search_filter=None):
+        now = time.time()
+        vector = self.normalize(query_vector)[None, :]
+        self.entries.append({
+            'query': user_query,
+            'answer': answer,
+            'filter': json.dumps(search_filter, sort_keys=True),
+            'duration': duration,
+            'created': now,
+            'last_used': now,
+        })
+        self.vectors = vector if self.vectors is None else np.vstack([self.vectors, vector])
+
+        if len(self.entries) > self.max_entries:
+            # Evict the least recently used entries
+            keep_rows = sorted(np.argsort([entry['last_used'] for entry in self.entries])[-self.max_entries:])
+            self.keep(keep_rows)
+
+    def expire(self):
+        now = time.time()
+        keep_rows = [row for row, entry in enumerate(self.entries) if now - entry['created'] < self.ttl]
+        if len(keep_rows) < len(self.entries):
+            self.keep(keep_rows)
+
+    def keep(self, rows):
+        self.entries = [self.entries[row] for row in rows]
+        self.vectors = self.vectors[rows] if self.entries else None
+
+    def save(self):
+        os.makedirs(self.cache_path, exist_ok=True)
+        if self.vectors is not None:
+            np.save(os.path.join(self.cache_path, self.VECTORS_FILE), self.vectors)
+
+        entries_path = os.path.join(self.cache_path, self.ENTRIES_FILE)
+        with open(entries_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'index_version': self.index_version, 'entries': self.entries}, file)
+        os.replace(entries_path + '.tmp', entries_path)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        print(f"Answer cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {self.time_saved:.1f}s saved.")
@@ -0,0 +1,566 @@
+# benchmarks.py
+# Run with: python benchmarks.py <benchmark_name> [key=value ...]
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import contextlib
+import random
+import string
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import re
+
+import nbformat
+import numpy as np
+import faiss
+
+from config import config
+from file_processing import FolderMethods
+from token_counting import get_encoding, count_tokens
+from faiss_index import build_index, apply_search_parameters, open_vector_store
+from generic_functions import escape_xml, is_allowed_filetype, decode_file_content, ALLOWED_EXTENSIONS
+from pull_request_diff import iter_diff_and_comments
+from github_fetcher import GitHubFetcher
+from git_methods import GitMethods
+from snapshot_cache import ETagStore
+
+
+def time_call(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def create_synthetic_tree(root, num_files=2000, files_per_dir=50, file_size=4000, notebook_ratio=0.02):
+    """
+    Creates a synthetic repository of source files (and a share of notebooks) under root.
+    """
+    rng = random.Random(42)
+    for index in range(num_files):
+        directory = os.path.join(root, f"package_{index // files_per_dir}")
+        os.makedirs(directory, exist_ok=True)
+        text = ''.join(rng.choice(string.ascii_letters + '    \n<>&') for _ in range(file_size))
+
+        if rng.random() < notebook_ratio:
+            # Cells must hold valid Python, nbconvert parses them
+            notebook = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(f"x_{index} = {text!r}")])
+            nbformat.write(notebook, os.path.join(directory, f"notebook_{index}.ipynb"))
+        else:
+            with open(os.path.join(directory, f"module_{index}.py"), 'w', encoding='utf-8') as file:
+                file.write(text)
+
+
+class SlowFolderMethods(FolderMethods):
+    # Adds a fixed delay to every file read, to mimic a network-mounted checkout
+    latency = 0.0
+
+    def read_local_file(self, file_path):
+        time.sleep(SlowFolderMethods.latency)
+        return super().read_local_file(file_path)
+
+
+def benchmark_folder_reading(num_files=2000, workers=8, latency=0.002):
+    """
+    Compares serial and thread-pool flattening of a synthetic tree and checks that the output is identical.
+    """
+    SlowFolderMethods.latency = float(latency)
+    with tempfile.TemporaryDirectory() as root:
+        create_synthetic_tree(root, num_files=int(num_files))
+
+        serial_output, serial_time = time_call(SlowFolderMethods(root, workers=1).process_local_directory)
+        parallel_output, parallel_time = time_call(SlowFolderMethods(root, workers=int(workers)).process_local_directory)
+
+    assert serial_output == parallel_output, "Parallel output differs from the serial output"
+    print(f"\nFolder reading ({num_files} files, {latency}s simulated latency per file)")
+    print(f"Serial:              {serial_time:.2f}s")
+    print(f"Parallel ({workers} workers): {parallel_time:.2f}s ({serial_time / parallel_time:.1f}x)")
+
+
+def create_ignored_directories(root, num_files=20000, files_per_dir=100):
+    # Files a walk should never read: installed packages, a virtual environment and build outputs
+    for index in range(num_files):
+        top = ('node_modules', 'venv/lib/site-packages', 'build')[index % 3]
+        directory = os.path.join(root, top, f"package_{index // files_per_dir}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"module_{index}.js" if top == 'node_modules' else f"module_{index}.py"), 'w') as file:
+            file.write("x = 1\n")
+
+
+def legacy_allowed_files(root):
+    # Folder walk as FolderMethods.iter_allowed_files did it before file_filter.py
+    for dirpath, dirnames, filenames in os.walk(root):
+        for file in filenames:
+            if any(file.endswith(ext) for ext in ALLOWED_EXTENSIONS):
+                yield os.path.join(dirpath, file)
+
+
+def benchmark_folder_walk(num_files=1000, ignored_files=20000):
+    """
+    Lists the files to flatten from a synthetic checkout with node_modules, a virtual environment and
+    build outputs, walking every folder (legacy) and pruning the ignored folders with FileFilter.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        create_synthetic_tree(root, num_files=int(num_files), file_size=200)
+        create_ignored_directories(root, num_files=int(ignored_files))
+
+        legacy_files, legacy_time = time_call(lambda: list(legacy_allowed_files(root)))
+        files, walk_time = time_call(lambda: list(FolderMethods(root).iter_allowed_files()))
+
+    print(f"\nFolder walk ({num_files} source files, {ignored_files} files in ignored folders)")
+    print(f"Legacy walk:  {len(legacy_files)} files in {legacy_time:.3f}s")
+    print(f"Pruned walk:  {len(files)} files in {walk_time:.3f}s ({legacy_time / walk_time:.1f}x)")
+
+
+def legacy_token_count(text, chunk_size=1000):
+    # Token counting as create_text_file.get_token_count did it before token_counting.py
+    encoding = get_encoding()
+    text_without_tags = re.sub(r'<[^>]+>', '', text)
+    chunks = [text_without_tags[i:i+chunk_size] for i in range(0, len(text_without_tags), chunk_size)]
+    return sum(len(encoding.encode(chunk, disallowed_special=[])) for chunk in chunks)
+
+
+def benchmark_token_counting(input_file='uncompressed_output.txt', repeat=3):
+    """
+    Compares the per-file batch token counter with the legacy 1000-character chunk counter
+    and checks its total against encoding the whole text at once.
+    """
+    with open(input_file, 'r', encoding='utf-8') as file:
+        text = file.read()
+    encoding = get_encoding()
+    repeat = int(repeat)
+
+    exact_count = len(encoding.encode_ordinary(re.sub(r'<[^>]+>', '', text)))
+    legacy_count, legacy_time = time_call(lambda: [legacy_token_count(text) for _ in range(repeat)])
+    (total_count, token_table), batch_time = time_call(lambda: [count_tokens(text) for _ in range(repeat)][-1])
+
+    assert total_count == exact_count, f"Batch count {total_count} differs from whole-text count {exact_count}"
+    print(f"\nToken counting ({len(text) / 1e6:.1f} MB, {len(token_table)} files/sources, {repeat} runs)")
+    print(f"Whole-text count: {exact_count}")
+    print(f"Legacy chunks:    {legacy_count[0]} tokens in {legacy_time / repeat:.3f}s per run")
+    print(f"Per-file batch:   {total_count} tokens in {batch_time / repeat:.3f}s per run")
+
+
+def load_corpus_vectors(vector_db_path):
+    # Embeds the chunks of the saved vector database again (mostly embedding cache hits), in index order
+    from create_vector_db import load_embeddings, close_embeddings
+
+    embeddings = load_embeddings()
+    vector_store = open_vector_store(embeddings, vector_db_path)
+    texts = [vector_store.docstore.search(vector_store.index_to_docstore_id[i]).page_content for i in range(vector_store.index.ntotal)]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    close_embeddings(embeddings)
+    return vectors
+
+
+def search_latency(index, queries, k):
+    # Searches one query at a time, like a question in prompt_llm does
+    results = np.empty((len(queries), k), dtype=np.int64)
+    start_time = time.perf_counter()
+    for row, query in enumerate(queries):
+        results[row] = index.search(query[None, :], k)[1][0]
+    return results, (time.perf_counter() - start_time) / len(queries)
+
+
+def benchmark_index_recall(vector_db_path=None, k=10, num_queries=200, index_types='ivf_flat,ivf_pq,hnsw'):
+    """
+    Reports recall@k and the latency per query of the approximate FAISS index types against exact
+    search, on the chunks of the saved vector database, for a range of nprobe / efSearch values.
+    The queries are chunks held out of the indexes, so no query finds itself.
+    """
+    vectors = load_corpus_vectors(vector_db_path or config.vector_db_path)
+    query_rows = np.random.default_rng(42).choice(len(vectors), min(int(num_queries), len(vectors) // 2), replace=False)
+    queries = vectors[query_rows]
+    vectors = np.delete(vectors, query_rows, axis=0)
+    k = min(int(k), len(vectors))
+
+    exact_index = faiss.IndexFlatL2(vectors.shape[1])
+    exact_index.add(vectors)
+    exact_results, exact_latency = search_latency(exact_index, queries, k)
+    print(f"\nIndex recall@{k} ({len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries)")
+    print(f"{'flat (exact)':<24} recall 1.000  {exact_latency * 1000:.3f}ms/query")
+
+    configured_type = config.faiss_index_type
+    try:
+        for index_type in index_types.split(','):
+            config.faiss_index_type = index_type
+            index, build_time = time_call(lambda: build_index(vectors))
+            _, add_time = time_call(index.add, vectors)
+            print(f"{index_type} trained in {build_time:.2f}s, filled in {add_time:.2f}s")
+
+            settings = [dict(ef_search=value) for value in (16, 32, 64, 128, 256)] if index_type == 'hnsw' else [dict(nprobe=value) for value in (1, 4, 16, 64, 256)]
+            for setting in settings:
+                apply_search_parameters(index, index_type, **setting)
+                results, latency = search_latency(index, queries, k)
+                recall = np.mean([len(set(found) & set(exact)) / k for found, exact in zip(results, exact_results)])
+                label = ', '.join(f"{key}={value}" for key, value in setting.items())
+                print(f"{index_type + ' ' + label:<24} recall {recall:.3f}  {latency * 1000:.3f}ms/query")
+    finally:
+        config.faiss_index_type = configured_type
+
+
+def benchmark_index_load(vector_db_path=None, query='def main'):
+    """
+    Compares the time to load the vector database and answer a first retrieval in the 'memory' and 'mmap' load modes.
+    """
+    import resource
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from prompt_llm import load_vector_store, retrieve_context
+
+    embeddings = HuggingFaceEmbeddings()
+    load_mode = config.index_load_mode
+    print(f"\nIndex loading ({vector_db_path or config.vector_db_path})")
+    try:
+        for mode in ('memory', 'mmap'):
+            config.index_load_mode = mode
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            vector_store, load_time = time_call(load_vector_store, embeddings, vector_db_path)
+            context, query_time = time_call(retrieve_context, vector_store, query)
+            rss_growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+            print(f"{mode:<7} load {load_time:.3f}s, first retrieval {query_time:.3f}s, peak RSS +{rss_growth:.0f} MB ({len(context)} context characters)")
+            del vector_store
+    finally:
+        config.index_load_mode = load_mode
+
+
+def benchmark_hybrid_retrieval(vector_db_path=None, num_queries=100):
+    """
+    Looks up identifiers taken from the indexed chunks with the dense, keyword and hybrid searches,
+    and reports the latency per query and how often the identifier is in the retrieved chunks.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from prompt_llm import load_vector_store, dense_search, keyword_search, retrieve_documents
+
+    vector_store = load_vector_store(HuggingFaceEmbeddings(), vector_db_path)
+    rng = random.Random(42)
+    identifiers = set()
+    for position in rng.sample(range(vector_store.index.ntotal), min(int(num_queries), vector_store.index.ntotal)):
+        text = vector_store.docstore.search(vector_store.index_to_docstore_id[position]).page_content
+        identifiers.update(re.findall(r'\b[A-Za-z]+_\w+\b', text)[:1])
+    queries = {identifier: f"Where is {identifier} used?" for identifier in sorted(identifiers)}
+
+    searches = {
+        'dense': lambda query: dense_search(vector_store, query, config.retrieval_k),
+        'keyword': lambda query: keyword_search(vector_store, query, config.retrieval_k),
+        'hybrid': lambda query: retrieve_documents(vector_store, query),
+    }
+    print(f"\nRetrieval of {len(queries)} identifiers (top {config.retrieval_k} chunks)")
+    for name, search in searches.items():
+        results, search_time = time_call(lambda: {identifier: search(query) for identifier, query in queries.items()})
+        found = sum(any(identifier in doc.page_content for doc in docs) for identifier, docs in results.items())
+        print(f"{name:<8} found {found}/{len(queries)}, {search_time / len(queries) * 1000:.2f}ms/query")
+
+
+def create_synthetic_diff(num_lines=50000, lines_per_file=500, lines_per_hunk=50, comment_every=37):
+    """
+    Returns (tuple): A unified diff of about num_lines lines with unique lines, and review comments
+    on one line out of comment_every, positioned the way the GitHub API does.
+    """
+    lines, comments = [], []
+    file_number = 0
+    while len(lines) < num_lines:
+        path = f"src/module_{file_number}.py"
+        lines += [f"diff --git a/{path} b/{path}", f"index {file_number:07x}..{file_number + 1:07x} 100644", f"--- a/{path}", f"+++ b/{path}"]
+        position = 0
+        for hunk_start in range(1, lines_per_file, lines_per_hunk):
+            lines.append(f"@@ -{hunk_start},{lines_per_hunk} +{hunk_start},{lines_per_hunk} @@")
+            for line_number in range(hunk_start, hunk_start + lines_per_hunk - 1):
+                lines.append(f"{random.choice('+- ')}    value_{file_number}_{line_number} = compute({line_number})")
+                position += 1
+                if position % comment_every == 0:
+                    comments.append({"user": {"login": "reviewer"}, "body": f"Check line {line_number}", "path": path, "position": position, "original_line": line_number})
+            position += 1
+        file_number += 1
+    return "\n".join(lines), comments
+
+
+def legacy_pull_request_render(pull_request_diff, all_comments):
+    # Diff and comment merge as git_methods.process_github_pull_request did it before pull_request_diff.py
+    all_comments = sorted(all_comments, key=lambda comment: comment.get("position") or float("inf"))
+    formatted_text = ''
+    diff_lines = pull_request_diff.split("\n")
+    comment_index = 0
+    for line in diff_lines:
+        formatted_text += f'{escape_xml(line)}\n'
+        while comment_index < len(all_comments) and all_comments[comment_index].get("position") == diff_lines.index(line):
+            comment = all_comments[comment_index]
+            formatted_text += '<review_comment>\n'
+            formatted_text += f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
+            formatted_text += f'<content>{escape_xml(comment["body"])}</content>\n'
+            formatted_text += f'<path>{escape_xml(comment["path"])}</path>\n'
+            formatted_text += f'<line>{comment["original_line"]}</line>\n'
+            formatted_text += '</review_comment>\n'
+            comment_index += 1
+    return formatted_text
+
+
+def benchmark_pr_diff(num_lines=50000, legacy_lines=5000):
+    """
+    Renders a synthetic pull request diff with its review comments, with the single-pass renderer on
+    num_lines lines and with the legacy renderer (quadratic in the diff size) on the first legacy_lines lines.
+    """
+    random.seed(0)
+    # PR-level comments have no position, the legacy renderer looked them up on every remaining diff line
+    pull_request_comments = [{"user": {"login": "author"}, "body": f"Comment {number}"} for number in range(5)]
+    diff_text, comments = create_synthetic_diff(int(num_lines))
+    legacy_diff, legacy_comments = create_synthetic_diff(int(legacy_lines))
+    comments += pull_request_comments
+    legacy_comments += pull_request_comments
+
+    rendered, render_time = time_call(lambda: ''.join(iter_diff_and_comments(diff_text, comments)))
+    legacy_rendered, legacy_time = time_call(legacy_pull_request_render, legacy_diff, legacy_comments)
+    small_rendered, small_time = time_call(lambda: ''.join(iter_diff_and_comments(legacy_diff, legacy_comments)))
+
+    placed = rendered.count('<review_comment>')
+    assert placed == len(comments), f"{placed} of {len(comments)} comments rendered"
+    print(f"\nPull request diff ({diff_text.count(chr(10)) + 1} lines, {len(comments)} comments)")
+    print(f"Single pass: {render_time:.3f}s, {len(rendered) / 1e6:.1f} MB")
+    print(f"On {legacy_lines} lines: legacy {legacy_time:.3f}s ({legacy_rendered.count('<review_comment>')} comments placed), single pass {small_time:.3f}s")
+
+
+def create_synthetic_repository(num_files):
+    """
+    Returns (dict): Path to raw content of the files of a synthetic repository: source files in nested
+    folders, documentation pages and a binary file that is not flattened.
+    """
+    rng = random.Random(42)
+    files = {'README.md': b"# Synthetic repository\n", 'assets/logo.png': bytes(range(256))}
+    for index in range(num_files):
+        if index % 4 == 3:
+            path = f"docs/page_{index}.md"
+        else:
+            path = f"src/package_{index % 3}/{'nested/' if index % 5 == 0 else ''}module_{index}.py"
+        text = ''.join(rng.choice(string.ascii_letters + '  \n<>&') for _ in range(rng.randint(200, 2000)))
+        files[path] = f"# {path}\r\n{text}\n".encode()
+    return files
+
+
+def build_git_trees(files):
+    """
+    Builds the git trees of a repository from its files.
+
+    Returns (dict): Folder path ('' for the root) to its entries as (name, type, path), in git's
+    order: by name, folders sorting as if their name ended with a /.
+    """
+    folders = {'': {}}
+    for path in files:
+        parts = path.split('/')
+        for depth in range(1, len(parts)):
+            folder = '/'.join(parts[:depth])
+            folders.setdefault(folder, {})
+            folders['/'.join(parts[:depth - 1])][parts[depth - 1]] = ('tree', folder)
+        folders['/'.join(parts[:-1])][parts[-1]] = ('blob', path)
+    return {
+        folder: [(name, object_type, path) for name, (object_type, path) in sorted(entries.items(), key=lambda item: item[0] + ('/' if item[1][0] == 'tree' else ''))]
+        for folder, entries in folders.items()
+    }
+
+
+def start_github_stand_in(num_items, latency, retry_after, files):
+    """
+    Starts a stand-in of the GitHub REST API on localhost, in a background thread.
+
+    /repos/owner/repo answers with an ETag and 304 Not Modified when it is revalidated,
+    /repos/owner/repo/comments is paginated with next and last Links, /repos/owner/repo/issues/comments
+    with next Links only. The files of the repository are served by the Trees API (recursive or folder by
+    folder, and truncated half-way when server.truncate_trees is set), the blobs API, whose first download
+    is rate limited (429 with Retry-After), and the Contents API with raw downloads.
+    Every response is delayed by latency seconds. The number of responses per status is kept in server.statuses.
+    """
+    items = [{"id": number, "body": f"Comment {number}"} for number in range(num_items)]
+    repository_body = json.dumps({"full_name": "owner/repo", "default_branch": "main"})
+    repository_etag = '"repository-v1"'
+
+    trees = build_git_trees(files)
+    blob_shas = {path: hashlib.sha1(content).hexdigest() for path, content in files.items()}
+    blobs = {sha: files[path] for path, sha in blob_shas.items()}
+    tree_shas = {folder: hashlib.sha1(f"tree {folder}".encode()).hexdigest() for folder in trees}
+    tree_folders = {sha: folder for folder, sha in tree_shas.items()}
+    # The branch main points to the root tree
+    tree_folders['main'] = ''
+
+    def tree_entry(name, object_type, path):
+        if object_type == 'tree':
+            return {"path": name, "mode": "040000", "type": "tree", "sha": tree_shas[path]}
+        return {"path": name, "mode": "100644", "type": "blob", "sha": blob_shas[path], "size": len(files[path])}
+
+    def iter_recursive_entries(folder):
+        for name, object_type, path in trees[folder]:
+            yield dict(tree_entry(name, object_type, path), path=path)
+            if object_type == 'tree':
+                yield from iter_recursive_entries(path)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body=b"", headers=None):
+            with server.lock:
+                server.statuses[status] = server.statuses.get(status, 0) + 1
+            self.send_response(status)
+            for name, value in dict(headers or {}, **{"Content-Length": str(len(body))}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, data):
+            self.send(200, json.dumps(data).encode(), {"Content-Type": "application/json"})
+
+        def do_GET(self):
+            time.sleep(latency)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            base_url = f"http://127.0.0.1:{server.server_port}"
+            if url.path == "/repos/owner/repo":
+                if self.headers.get("If-None-Match") == repository_etag:
+                    self.send(304, headers={"ETag": repository_etag})
+                else:
+                    self.send(200, repository_body.encode(), {"ETag": repository_etag, "Content-Type": "application/json"})
+            elif url.path in ("/repos/owner/repo/comments", "/repos/owner/repo/issues/comments"):
+                per_page, page = int(query.get("per_page", ["30"])[0]), int(query.get("page", ["1"])[0])
+                last_page = max(1, -(-num_items // per_page))
+                base = f"{base_url}{url.path}?per_page={per_page}"
+                links = []
+                if page < last_page:
+                    links.append(f'<{base}&page={page + 1}>; rel="next"')
+                    if url.path == "/repos/owner/repo/comments":
+                        links.append(f'<{base}&page={last_page}>; rel="last"')
+                body = json.dumps(items[(page - 1) * per_page:page * per_page]).encode()
+                self.send(200, body, {"Link": ", ".join(links), "Content-Type": "application/json"})
+            elif url.path.startswith("/repos/owner/repo/git/trees/"):
+                sha = url.path.rsplit("/", 1)[-1]
+                if sha not in tree_folders:
+                    self.send(404)
+                elif query.get("recursive"):
+                    entries = list(iter_recursive_entries(tree_folders[sha]))
+                    truncated = server.truncate_trees
+                    self.send_json({"sha": sha, "tree": entries[:len(entries) // 2] if truncated else entries, "truncated": truncated})
+                else:
+                    entries = [tree_entry(*entry) for entry in trees[tree_folders[sha]]]
+                    self.send_json({"sha": sha, "tree": entries, "truncated": False})
+            elif url.path.startswith("/repos/owner/repo/git/blobs/"):
+                with server.lock:
+                    rate_limited, server.rate_limited = not server.rate_limited, True
+                sha = url.path.rsplit("/", 1)[-1]
+                if rate_limited:
+                    self.send(429, headers={"Retry-After": str(retry_after)})
+                elif sha in blobs:
+                    self.send(200, blobs[sha])
+                else:
+                    self.send(404)
+            elif url.path.startswith("/repos/owner/repo/contents"):
+                folder = url.path[len("/repos/owner/repo/contents"):].strip("/")
+                if folder not in trees:
+                    self.send(404)
+                else:
+                    self.send_json([{
+                        "name": name, "path": path, "type": "dir" if object_type == "tree" else "file",
+                        "url": f"{base_url}/repos/owner/repo/contents/{path}",
+                        "download_url": None if object_type == "tree" else f"{base_url}/raw/{path}",
+                    } for name, object_type, path in trees[folder]])
+            elif url.path.startswith("/raw/") and url.path[len("/raw/"):] in files:
+                self.send(200, files[url.path[len("/raw/"):]])
+            else:
+                self.send(404)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.statuses = {}
+    server.rate_limited = False
+    server.truncate_trees = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def legacy_process_git_directory(session, url, repo_content):
+    # Walk of the Contents API with one download per file, as GitMethods.process_git_directory did it before the Trees API
+    for file in session.get(url).json():
+        if file["type"] == "file" and is_allowed_filetype(file["name"]):
+            repo_content.append(f'<file name="{escape_xml(file["path"])}">')
+            repo_content.append(escape_xml(decode_file_content(session.get(file["download_url"]).content)))
+            repo_content.append('</file>')
+        elif file["type"] == "dir":
+            legacy_process_git_directory(session, file["url"], repo_content)
+
+
+def benchmark_github_fetcher(num_items=5000, num_files=100, latency=0.02, workers=8, retry_after=1):
+    """
+    Runs GitHubFetcher against a local stand-in of the GitHub API (see start_github_stand_in):
+    paginated lists fetched concurrently (Link last) and page by page (Link next only), ETag revalidation,
+    the backoff on a rate limited download, and a repository flattened from the Trees API (in one call and
+    folder by folder when the tree is truncated) against the per-file Contents API walk it replaced.
+    """
+    files = create_synthetic_repository(int(num_files))
+    server = start_github_stand_in(int(num_items), float(latency), int(retry_after), files)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    configured_url, configured_workers = config.github_api_base_url, config.github_fetch_workers
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fetcher = GitHubFetcher(api_base_url=base_url, max_workers=int(workers), etag_store=ETagStore(os.path.join(temp_dir, 'etags.json')))
+        try:
+            print(f"\nGitHub fetcher against a local stand-in ({num_items} items, {len(files)} files, {float(latency) * 1000:.0f}ms latency, {workers} workers)")
+
+            concurrent_items, concurrent_time = time_call(fetcher.get_all_pages, f"{base_url}/repos/owner/repo/comments")
+            sequential_items, sequential_time = time_call(fetcher.get_all_pages, f"{base_url}/repos/owner/repo/issues/comments")
+            expected_ids = list(range(int(num_items)))
+            assert [item["id"] for item in concurrent_items] == expected_ids, "pages fetched concurrently are out of order"
+            assert [item["id"] for item in sequential_items] == expected_ids, "pages followed one by one are out of order"
+            print(f"Pagination: {len(concurrent_items)} items, concurrent pages {concurrent_time:.3f}s, page by page {sequential_time:.3f}s")
+
+            statuses_before = dict(server.statuses)
+            first_branch, first_time = time_call(fetcher.get_default_branch, "owner/repo")
+            second_branch, second_time = time_call(fetcher.get_default_branch, "owner/repo")
+            not_modified = server.statuses.get(304, 0) - statuses_before.get(304, 0)
+            assert first_branch == second_branch == "main" and not_modified == 1, "the ETag was not revalidated"
+            print(f"ETag revalidation: first call {first_time:.3f}s, revalidated call {second_time:.3f}s (304 Not Modified)")
+
+            readme_sha = hashlib.sha1(files['README.md']).hexdigest()
+            blob, blob_time = time_call(fetcher.fetch_blob, "owner/repo", readme_sha)
+            assert blob == files['README.md'] and server.statuses.get(429) == 1, "the rate limited download was not retried"
+            assert blob_time >= int(retry_after), "the Retry-After delay was not respected"
+            print(f"Rate limit: 429 with Retry-After {retry_after}s, downloaded after {blob_time:.3f}s")
+
+            legacy_content, legacy_time = [], time.perf_counter()
+            legacy_process_git_directory(fetcher.session, f"{base_url}/repos/owner/repo/contents", legacy_content)
+            legacy_time = time.perf_counter() - legacy_time
+
+            config.github_api_base_url, config.github_fetch_workers = base_url, int(workers)
+            git_methods = GitMethods("https://github.com/owner/repo")
+            for truncated in (False, True):
+                server.truncate_trees = truncated
+                tree_content = []
+                with contextlib.redirect_stdout(io.StringIO()):
+                    _, tree_time = time_call(git_methods.process_git_tree, "owner/repo", "main", "", tree_content)
+                assert tree_content == legacy_content, f"the Trees API output {'(folder by folder) ' if truncated else ''}differs from the Contents API walk"
+                label = "folder by folder (truncated tree)" if truncated else "one recursive call"
+                print(f"Repository ({len(tree_content) // 3} files): Trees API {label} {tree_time:.3f}s, Contents API walk {legacy_time:.3f}s")
+        finally:
+            config.github_api_base_url, config.github_fetch_workers = configured_url, configured_workers
+            fetcher.session.close()
+            server.shutdown()
+            server.server_close()
+
+
+BENCHMARKS = {
+    'folder_reading': benchmark_folder_reading,
+    'folder_walk': benchmark_folder_walk,
+    'token_counting': benchmark_token_counting,
+    'index_recall': benchmark_index_recall,
+    'index_load': benchmark_index_load,
+    'hybrid_retrieval': benchmark_hybrid_retrieval,
+    'pr_diff': benchmark_pr_diff,
+    'github_fetcher': benchmark_github_fetcher,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmarks.py <{'|'.join(BENCHMARKS)}> [key=value ...]")
+        sys.exit(1)
+
+    params = dict(arg.split('=') for arg in sys.argv[2:])
+    BENCHMARKS[sys.argv[1]](**params)
@@ -0,0 +1,195 @@
+import re
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore, AddableMixin
+
+# Name of the chunk store file inside the vector database folder
+CHUNK_STORE_FILE = 'chunks.sqlite'
+
+# Full-text index over the chunk texts, kept in sync with the chunks table by triggers. It references the
+# texts of the chunks table instead of copying them, and keeps identifiers like snake_case names as one token.
+KEYWORD_INDEX_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', tokenize=\"unicode61 tokenchars '_'\")",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+    "INSERT INTO chunks_fts (rowid, text) VALUES (new.rowid, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+    "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF text ON chunks BEGIN "
+    "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text); "
+    "INSERT INTO chunks_fts (rowid, text) VALUES (new.rowid, new.text); END",
+)
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """
+    Docstore for the LangChain FAISS wrapper that keeps the chunks in a SQLite file.
+
+    Every chunk row holds its id, its position in the FAISS index, its text and its metadata, indexed
+    by id and by position, and an FTS5 index over the texts serves BM25 keyword searches. Chunks are read
+    one at a time, so a query only reads the chunks it retrieved, and adds, upserts and deletes only
+    touch the affected rows (the keyword index included). Writes are kept in one transaction
+    until commit() is called, so an interrupted update leaves the saved store unchanged.
+    Read-only stores are memory-mapped so several processes share the same pages.
+    """
+    # Bytes of the database file SQLite may memory-map
+    MMAP_SIZE = 1024 ** 3
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            self.connection.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+        else:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, position INTEGER, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+                )
+                self.connection.execute("CREATE INDEX IF NOT EXISTS chunks_position ON chunks (position)")
+            self.create_keyword_index()
+        self.index_to_docstore_id = ChunkPositions(self)
+        self.has_keyword_index = bool(self.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'"))
+
+    def create_keyword_index(self):
+        try:
+            has_keyword_index = bool(self.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'"))
+            with self.connection:
+                for statement in KEYWORD_INDEX_SCHEMA:
+                    self.connection.execute(statement)
+                if not has_keyword_index:
+                    # Index the chunks of a store created before the keyword index
+                    self.connection.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as error:
+            # SQLite builds without FTS5 only support dense retrieval
+            print(f"Keyword index not available: {error}")
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def executemany(self, sql, rows):
+        with self.lock:
+            self.connection.executemany(sql, rows)
+
+    def search(self, search):
+        rows = self.execute("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        text, metadata = rows[0]
+        return Document(id=search, page_content=text, metadata=json.loads(metadata))
+
+    def add(self, texts):
+        """
+        Adds or updates chunks. Updated chunks keep their position in the FAISS index.
+
+        Args:
+        texts (dict): Chunk id mapped to its Document.
+        """
+        self.executemany(
+            "INSERT INTO chunks (id, text, metadata) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET text = excluded.text, metadata = excluded.metadata",
+            ((chunk_id, doc.page_content, json.dumps(doc.metadata)) for chunk_id, doc in texts.items())
+        )
+
+    def keyword_search(self, query, k=4, search_filter=None):
+        """
+        Ranks the indexed chunks by BM25 against the words of the query.
+
+        Args:
+        query (str): Question or identifiers to look for. Chunks matching any of its words are ranked.
+        k (int): Number of chunks to return.
+        search_filter (dict): Metadata values the chunks must have, e.g. {'path': 'src/main.py'}.
+
+        Returns (list): Documents, best match first.
+        """
+        terms = re.findall(r'\w+', query)
+        if not terms or not self.has_keyword_index:
+            return []
+
+        sql = (
+            "SELECT chunks.id, chunks.text, chunks.metadata FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? AND chunks.position IS NOT NULL"
+        )
+        parameters = [' OR '.join(f'"{term}"' for term in dict.fromkeys(terms))]
+        for key, value in (search_filter or {}).items():
+            sql += " AND json_extract(chunks.metadata, ?) = ?"
+            parameters += [f'$."{key}"', value]
+        rows = self.execute(sql + " ORDER BY bm25(chunks_fts) LIMIT ?", (*parameters, k))
+        return [Document(id=chunk_id, page_content=text, metadata=json.loads(metadata)) for chunk_id, text, metadata in rows]
+
+    def optimize(self):
+        # Merges the b-trees of the keyword index into one, after a full build
+        if self.has_keyword_index:
+            with self.lock, self.connection:
+                self.connection.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('optimize')")
+
+    def get_positions(self, ids):
+        positions = []
+        for chunk_id in ids:
+            rows = self.execute("SELECT position FROM chunks WHERE id = ?", (chunk_id,))
+            if not rows or rows[0][0] is None:
+                raise ValueError(f"Chunk {chunk_id} is not in the vector database")
+            positions.append(rows[0][0])
+        return positions
+
+    def delete(self, ids):
+        """
+        Deletes chunks and shifts the positions of the chunks behind them, the way
+        IndexFlat.remove_ids compacts the vectors of the FAISS index.
+        """
+        removed_positions = sorted(self.get_positions(ids))
+        with self.lock:
+            self.connection.executemany("DELETE FROM chunks WHERE id = ?", ((chunk_id,) for chunk_id in ids))
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS removed_positions (position INTEGER PRIMARY KEY)")
+            self.connection.execute("DELETE FROM removed_positions")
+            self.connection.executemany("INSERT INTO removed_positions VALUES (?)", ((position,) for position in removed_positions))
+            self.connection.execute(
+                "UPDATE chunks SET position = position - "
+                "(SELECT COUNT(*) FROM removed_positions WHERE removed_positions.position < chunks.position) "
+                "WHERE position > ?", (removed_positions[0] if removed_positions else 0,)
+            )
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.execute("SELECT COUNT(*) FROM chunks")[0][0]
+
+
+class ChunkPositions(MutableMapping):
+    """
+    index_to_docstore_id mapping of a ChunkStore: FAISS position -> chunk id, read from and written to the store on access.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, position):
+        rows = self.store.execute("SELECT id FROM chunks WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __setitem__(self, position, chunk_id):
+        self.update({position: chunk_id})
+
+    def __delitem__(self, position):
+        self.store.execute("UPDATE chunks SET position = NULL WHERE position = ?", (int(position),))
+
+    def update(self, positions):
+        # Called by the FAISS wrapper with the positions of every added batch of chunks
+        self.store.executemany("UPDATE chunks SET position = ? WHERE id = ?", ((int(position), chunk_id) for position, chunk_id in positions.items()))
+
+    def __iter__(self):
+        return (row[0] for row in self.store.execute("SELECT position FROM chunks WHERE position IS NOT NULL ORDER BY position"))
+
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(position) FROM chunks")[0][0]
@@ -0,0 +1,139 @@
+import re
+from xml.sax.saxutils import unescape
+
+from langchain_core.documents import Document
+
+from token_counting import get_encoding
+
+# Matches the <source> opening elements and the <file> elements written by
+# FolderMethods.process_local_directory and GitMethods.process_git_tree
+UNIT_PATTERN = re.compile(
+    r'<source type="(?P<type>[^"]*)" (?:path|url|identifier)="(?P<ref>[^"]*)">'
+    r'|<file name="(?P<name>[^"]*)">\n(?P<body>.*?)\n</file>',
+    re.DOTALL
+)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+# Runs of blank lines left where tags were removed
+BLANK_LINES_PATTERN = re.compile(r'\n[ \t]*(?:\n[ \t]*)+\n')
+
+# Lines that start a top-level definition (Python, JavaScript/TypeScript, SQL, Markdown headings...)
+DEFINITION_PATTERN = re.compile(
+    r'(?:@|(?:async\s+)?def\s|class\s|(?:export\s+)?(?:default\s+)?(?:async\s+)?function[\s*]'
+    r'|(?:export\s+)?(?:const|let|var|interface|type|enum)\s|#{1,6}\s|(?i:create|alter)\s)'
+)
+
+
+def split_into_units(text):
+    """
+    Splits the flattened text into units: one per <file> element, plus the text outside of <file> elements per source.
+
+    Args:
+    text (str): Content of the uncompressed output file.
+
+    Returns (dict): Unit key mapped to the unit, in document order. A unit is a dict holding the unescaped
+    text, source_type, source (path or URL of the source) and path (file name, '' outside of files).
+    """
+    units = {}
+    leftovers = {}
+    source = {'source_type': '', 'source': ''}
+    position = 0
+
+    for match in UNIT_PATTERN.finditer(text):
+        leftovers.setdefault(source['source'], (source, []))[1].append(text[position:match.start()])
+        position = match.end()
+
+        if match.group('name') is None:
+            source = {'source_type': match.group('type'), 'source': match.group('ref')}
+            leftovers.setdefault(source['source'], (source, []))[1].append(match.group(0))
+        else:
+            path = unescape(match.group('name'))
+            units[f"{source['source_type']}:{source['source']}::{path}"] = dict(source, path=path, text=unescape(match.group('body')))
+    leftovers.setdefault(source['source'], (source, []))[1].append(text[position:])
+
+    # Text outside of <file> elements (PR descriptions, issue comments, papers...): without the XML tags and
+    # unescaped like the file bodies, and only kept if it holds more than tags
+    for source, parts in leftovers.values():
+        leftover_text = unescape(BLANK_LINES_PATTERN.sub('\n\n', TAG_PATTERN.sub('', ''.join(parts)))).strip()
+        if leftover_text:
+            units[f"{source['source_type']}:{source['source']}"] = dict(source, path='', text=leftover_text)
+
+    return units
+
+
+def find_segment_starts(lines):
+    """
+    Returns the indices of the lines that start a new segment: top-level definitions,
+    and non-indented lines after a blank line. Decorators stay with the definition they decorate.
+    """
+    starts = [0]
+    for index in range(1, len(lines)):
+        line, previous_line = lines[index], lines[index - 1]
+        if not line or line[0].isspace() or previous_line.startswith('@'):
+            continue
+        if DEFINITION_PATTERN.match(line) or not previous_line.strip():
+            starts.append(index)
+    return starts
+
+
+def chunk_unit(unit, max_tokens=350):
+    """
+    Splits a unit into Documents of at most max_tokens tokens.
+
+    Segments (see find_segment_starts) are packed together while they fit the budget. Segments that
+    don't fit on their own are split on line boundaries, and single lines that don't fit (minified code,
+    long paragraphs) on token boundaries. Every Document carries the source_type, source, path and the
+    1-based start_line and end_line of the chunk within the unit. Parts of a line carry its number as
+    line instead, they don't span whole lines.
+    """
+    encoding = get_encoding()
+    lines = unit['text'].split('\n')
+    starts = find_segment_starts(lines)
+    segments = list(zip(starts, starts[1:] + [len(lines)]))
+
+    documents = []
+    chunk_start, chunk_tokens = None, 0
+
+    def add_document(start, end):
+        chunk_text = '\n'.join(lines[start:end])
+        if chunk_text.strip():
+            metadata = {key: unit[key] for key in ('source_type', 'source', 'path')}
+            metadata.update(start_line=start + 1, end_line=end)
+            documents.append(Document(page_content=chunk_text, metadata=metadata))
+
+    def add_line_parts(index, line_tokens):
+        metadata = {key: unit[key] for key in ('source_type', 'source', 'path')}
+        metadata.update(line=index + 1)
+        for part_start in range(0, len(line_tokens), max_tokens):
+            documents.append(Document(page_content=encoding.decode(line_tokens[part_start:part_start + max_tokens]), metadata=dict(metadata)))
+
+    for start, end in segments:
+        segment_tokens = len(encoding.encode_ordinary('\n'.join(lines[start:end])))
+        if chunk_start is not None and chunk_tokens + segment_tokens > max_tokens:
+            add_document(chunk_start, start)
+            chunk_start, chunk_tokens = None, 0
+
+        if segment_tokens <= max_tokens:
+            if chunk_start is None:
+                chunk_start = start
+            chunk_tokens += segment_tokens
+            continue
+
+        # Segment too large for one chunk: split it on line boundaries
+        window_start, window_tokens = start, 0
+        for index in range(start, end):
+            line_tokens = encoding.encode_ordinary(lines[index])
+            if len(line_tokens) > max_tokens:
+                # Line too large for one chunk: split it on token boundaries
+                add_document(window_start, index)
+                add_line_parts(index, line_tokens)
+                window_start, window_tokens = index + 1, 0
+                continue
+            if index > window_start and window_tokens + len(line_tokens) + 1 > max_tokens:
+                add_document(window_start, index)
+                window_start, window_tokens = index, 0
+            window_tokens += len(line_tokens) + 1
+        add_document(window_start, end)
+
+    if chunk_start is not None:
+        add_document(chunk_start, len(lines))
+    return documents
@@ -1,9 +1,109 @@
 # config.py
+def parse_bool(value):
+    # Boolean options can be given as strings (key=value command line parameters)
+    if isinstance(value, str):
+        if value.strip().lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if value.strip().lower() in ('0', 'false', 'no', 'off', ''):
+            return False
+        raise ValueError(f"Not a boolean value: {value}")
+    return bool(value)
+
 class Config:
     def __init__(self, **kwargs):
         # Add more parameters as needed
         self.rag_working_name = kwargs.get('rag_working_name', 'faiss_aimodel')
         self.text_file_path = kwargs.get('text_file_path', './text_files')
 
+        # Number of threads reading local files while flattening a folder
+        self.folder_read_workers = int(kwargs.get('folder_read_workers', 8))
+
+        # PDF papers: number of processes extracting pages, and cache of extracted text keyed by content hash
+        self.pdf_workers = int(kwargs.get('pdf_workers', 4))
+        # Papers with fewer pages are extracted in-process, starting the worker processes would take longer
+        self.pdf_parallel_min_pages = int(kwargs.get('pdf_parallel_min_pages', 64))
+        self.pdf_cache_path = kwargs.get('pdf_cache_path', 'pdf_cache')
+
+        # GitHub API: base URL (can point to a local stand-in server) and number of concurrent downloads
+        self.github_api_base_url = kwargs.get('github_api_base_url', 'https://api.github.com')
+        self.github_fetch_workers = int(kwargs.get('github_fetch_workers', 8))
+
+        # Files of local folders and git trees: ignore patterns (.gitignore syntax) on top of file_filter.DEFAULT_IGNORE_PATTERNS,
+        # whether the .gitignore files of local folders apply, and the size in bytes above which files are skipped
+        self.ignore_patterns = kwargs.get('ignore_patterns', [])
+        self.use_gitignore = parse_bool(kwargs.get('use_gitignore', True))
+        self.max_file_size = int(kwargs.get('max_file_size', 1024 ** 2))
+
+        # Batch mode of create_text_file: number of inputs of each type processed at the same time
+        self.batch_git_inputs = int(kwargs.get('batch_git_inputs', 2))
+        self.batch_folder_inputs = int(kwargs.get('batch_folder_inputs', 2))
+        self.batch_arxiv_inputs = int(kwargs.get('batch_arxiv_inputs', 2))
+        self.batch_paper_inputs = int(kwargs.get('batch_paper_inputs', 1))
+        self.batch_youtube_inputs = int(kwargs.get('batch_youtube_inputs', 4))
+        self.batch_web_inputs = int(kwargs.get('batch_web_inputs', 1))
+
+        # Cache of flattened repositories, keyed by commit SHA
+        self.use_snapshot_cache = parse_bool(kwargs.get('use_snapshot_cache', True))
+        self.snapshot_cache_path = kwargs.get('snapshot_cache_path', 'snapshot_cache')
+        self.snapshot_cache_max_bytes = int(kwargs.get('snapshot_cache_max_bytes', 2 * 1024 ** 3))
+
+        # Vector database
+        self.vector_db_path = kwargs.get('vector_db_path', 'vector_database')
+        # Only re-embed the files that changed since the previous run
+        self.incremental_indexing = parse_bool(kwargs.get('incremental_indexing', False))
+        # Maximum number of (cl100k_base) tokens per chunk
+        self.chunk_max_tokens = int(kwargs.get('chunk_max_tokens', 350))
+
+        # Embedding cache
+        self.use_embedding_cache = parse_bool(kwargs.get('use_embedding_cache', True))
+        self.embedding_cache_path = kwargs.get('embedding_cache_path', 'embedding_cache')
+        self.embedding_cache_max_entries = int(kwargs.get('embedding_cache_max_entries', 200000))
+
+        # Embedding pipeline: number of chunks per batch and worker processes (1 embeds in-process)
+        self.embedding_batch_size = int(kwargs.get('embedding_batch_size', 64))
+        self.embedding_workers = int(kwargs.get('embedding_workers', 1))
+
+        # FAISS index type: 'flat' (exact search), 'ivf_flat', 'ivf_pq' or 'hnsw'
+        self.faiss_index_type = kwargs.get('faiss_index_type', 'flat')
+        # Number of vectors the IVF indexes are trained on (a random sample of the corpus)
+        self.faiss_train_size = int(kwargs.get('faiss_train_size', 20000))
+        # Number of IVF clusters, 0 picks ~4 * sqrt(number of training vectors)
+        self.faiss_nlist = int(kwargs.get('faiss_nlist', 0))
+        # IVF-PQ: number of sub-quantizers (must divide the embedding dimension) and bits per code
+        self.faiss_pq_m = int(kwargs.get('faiss_pq_m', 16))
+        self.faiss_pq_nbits = int(kwargs.get('faiss_pq_nbits', 8))
+        # HNSW: neighbours per node and search depth while building
+        self.faiss_hnsw_m = int(kwargs.get('faiss_hnsw_m', 32))
+        self.faiss_ef_construction = int(kwargs.get('faiss_ef_construction', 200))
+        # Query-time accuracy/speed trade-off, applied when the index is loaded (no rebuild needed)
+        self.faiss_nprobe = int(kwargs.get('faiss_nprobe', 16))
+        self.faiss_ef_search = int(kwargs.get('faiss_ef_search', 64))
+        # How prompt_llm loads the vector database: 'mmap' maps the index and reads chunks on demand, 'memory' loads everything
+        self.index_load_mode = kwargs.get('index_load_mode', 'mmap')
+
+        # Retrieval: number of chunks added to the prompt, and whether BM25 keyword results are fused with the dense results
+        self.retrieval_k = int(kwargs.get('retrieval_k', 4))
+        self.hybrid_search = parse_bool(kwargs.get('hybrid_search', True))
+        # Candidates fetched from each search before fusion, and the constant of reciprocal-rank fusion
+        self.hybrid_candidates = int(kwargs.get('hybrid_candidates', 20))
+        self.rrf_k = int(kwargs.get('rrf_k', 60))
+        # Token budget (cl100k_base tokens) of the retrieved context added to the prompt
+        self.context_max_tokens = int(kwargs.get('context_max_tokens', 3000))
+
+        # Semantic answer cache (off by default): a query reuses the answer of a cached query whose embedding has
+        # at least this cosine similarity with it and that mentions the same identifiers and numbers,
+        # entries expire after answer_cache_ttl seconds
+        self.use_answer_cache = parse_bool(kwargs.get('use_answer_cache', False))
+        self.answer_cache_path = kwargs.get('answer_cache_path', 'answer_cache')
+        self.answer_cache_threshold = float(kwargs.get('answer_cache_threshold', 0.95))
+        self.answer_cache_ttl = float(kwargs.get('answer_cache_ttl', 24 * 3600))
+        self.answer_cache_max_entries = int(kwargs.get('answer_cache_max_entries', 1000))
+
+        # Batch question mode: number of concurrent LLM calls
+        self.batch_llm_workers = int(kwargs.get('batch_llm_workers', 8))
+
+        # Stream the answer of a single question token by token (llm.stream) instead of waiting for the whole completion
+        self.stream_generation = parse_bool(kwargs.get('stream_generation', True))
+
 # Global config instance
 config = Config()
\ No newline at end of file
@@ -0,0 +1,154 @@
+from token_counting import get_encoding
+
+# Shortest run of characters counted as an overlap between chunks without line numbers
+MIN_TEXT_OVERLAP = 20
+
+
+def subtract_ranges(start, end, covered):
+    """
+    Returns (list): The (start, end) line ranges of start..end (inclusive) that are not in the covered ranges.
+    """
+    ranges = [(start, end)]
+    for covered_start, covered_end in covered:
+        remaining = []
+        for range_start, range_end in ranges:
+            if covered_end < range_start or covered_start > range_end:
+                remaining.append((range_start, range_end))
+                continue
+            if range_start < covered_start:
+                remaining.append((range_start, covered_start - 1))
+            if range_end > covered_end:
+                remaining.append((covered_end + 1, range_end))
+        ranges = remaining
+    return ranges
+
+
+def remove_text_overlap(text, kept_texts):
+    # Chunks without line numbers: drop the text repeated from the end of a chunk that is already kept
+    for kept_text in kept_texts:
+        if text in kept_text:
+            return ''
+        for size in range(min(len(text), len(kept_text)), MIN_TEXT_OVERLAP - 1, -1):
+            if kept_text.endswith(text[:size]):
+                text = text[size:]
+                break
+    return text
+
+
+def get_unit_key(doc):
+    metadata = doc.metadata
+    return (metadata.get('source_type', ''), metadata.get('source', ''), metadata.get('path', ''))
+
+
+def split_into_pieces(doc, covered_lines, kept_texts):
+    """
+    Removes the text that a retrieved chunk shares with the chunks already selected for the context.
+
+    Chunks of the same file are compared on their start_line/end_line metadata (see chunking.py),
+    other chunks on their text.
+
+    Args:
+    doc (Document): The retrieved chunk.
+    covered_lines (dict): Unit key to the line ranges of the selected chunks, see mark_selected.
+    kept_texts (list): Texts of the selected chunks without line numbers.
+
+    Returns (list): The remaining pieces of the chunk. A piece is a dict holding the unit key,
+    the label, the line range (None without line numbers) and the text.
+    """
+    metadata = doc.metadata
+    key = get_unit_key(doc)
+    label = metadata.get('path') or metadata.get('source', '')
+    pieces = []
+
+    if 'start_line' in metadata:
+        lines = doc.page_content.split('\n')
+        start_line = metadata['start_line']
+        for start, end in subtract_ranges(start_line, start_line + len(lines) - 1, covered_lines.get(key, [])):
+            text = '\n'.join(lines[start - start_line:end - start_line + 1])
+            if text.strip():
+                pieces.append({'key': key, 'label': label, 'lines': (start, end), 'text': text})
+    else:
+        text = remove_text_overlap(doc.page_content, kept_texts)
+        if text.strip():
+            pieces.append({'key': key, 'label': label, 'lines': None, 'text': text})
+    return pieces
+
+
+def mark_selected(doc, covered_lines, kept_texts):
+    # The text of a chunk that is added to the context is left out of the chunks ranked below it
+    if 'start_line' in doc.metadata:
+        start_line = doc.metadata['start_line']
+        covered_lines.setdefault(get_unit_key(doc), []).append((start_line, start_line + doc.page_content.count('\n')))
+    else:
+        kept_texts.append(doc.page_content)
+
+
+def render_blocks(pieces):
+    """
+    Orders the pieces by source, file and line, and merges consecutive lines of a file into one block.
+
+    Returns (list): The blocks as text, each under a header naming its file and lines when known.
+    """
+    blocks = []
+    ordered = sorted(pieces, key=lambda piece: (piece['key'], piece['lines'] or (0, 0)))
+    for piece in ordered:
+        previous = blocks[-1] if blocks else None
+        if previous and piece['lines'] and previous['key'] == piece['key'] and previous['lines'] and previous['lines'][1] + 1 == piece['lines'][0]:
+            previous['text'] += '\n' + piece['text']
+            previous['lines'] = (previous['lines'][0], piece['lines'][1])
+        else:
+            blocks.append(dict(piece))
+
+    rendered = []
+    for block in blocks:
+        if not block['label']:
+            # Chunks without source metadata (vector databases built before chunking.py)
+            rendered.append(block['text'])
+            continue
+        header = f"File: {block['label']}"
+        if block['lines']:
+            header += f" (lines {block['lines'][0]}-{block['lines'][1]})"
+        rendered.append(f"{header}\n{block['text']}")
+    return rendered
+
+
+def pack_context(documents, max_tokens):
+    """
+    Assembles the prompt context from the retrieved chunks within a token budget.
+
+    Overlapping text is only kept once, chunks are added in rank order while they fit max_tokens
+    (cl100k_base tokens, as counted by token_counting.py) and the result is ordered by source and line.
+
+    Args:
+    documents (list): Retrieved Documents, best match first.
+    max_tokens (int): Token budget of the context.
+
+    Returns (tuple): The context text and a dict of token counts: 'retrieved' (all chunks joined with spaces),
+    'context', 'overlap' (removed duplicate text) and 'over_budget' (chunks left out).
+    """
+    encoding = get_encoding()
+    stats = {'retrieved': len(encoding.encode_ordinary(" ".join(doc.page_content for doc in documents))), 'overlap': 0, 'over_budget': 0}
+
+    selected = []
+    used_tokens = 0
+    covered_lines = {}
+    kept_texts = []
+    for doc in documents:
+        # Only the chunks that fit in the budget cover text, so a chunk left out removes nothing from the others
+        pieces = split_into_pieces(doc, covered_lines, kept_texts)
+        document_tokens = len(encoding.encode_ordinary(doc.page_content))
+        # Every piece can get its own header line
+        piece_tokens = sum(len(encoding.encode_ordinary(f"File: {piece['label']} (lines 0-0)\n{piece['text']}\n\n")) for piece in pieces)
+        piece_text_tokens = sum(len(encoding.encode_ordinary(piece['text'])) for piece in pieces)
+        stats['overlap'] += max(document_tokens - piece_text_tokens, 0)
+
+        if used_tokens + piece_tokens > max_tokens:
+            stats['over_budget'] += piece_text_tokens
+            continue
+        selected.extend(pieces)
+        used_tokens += piece_tokens
+        mark_selected(doc, covered_lines, kept_texts)
+
+    context = '\n\n'.join(render_blocks(selected))
+    stats['context'] = len(encoding.encode_ordinary(context))
+    return context, stats
@@ -1,7 +1,10 @@
+import os
 import sys
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-import tiktoken
-import re
 import pyperclip
 
 
@@ -13,11 +16,15 @@ from rich.text import Text
 from rich.prompt import Prompt
 from rich.style import Style
 from rich.syntax import Syntax
+from rich.table import Table
 from rich.traceback import install
 from rich.progress import Progress, TextColumn, BarColumn, TimeRemainingColumn
 
 # Repository classes and scripts
 from git_methods import GitMethods
+from snapshot_cache import SnapshotCache
+from config import config
+from token_counting import count_file_tokens
 import generic_functions as generic_functions
 from file_processing import TextFileMethods, PDFFileMethods, FolderMethods, TranscriptionMethods
 
@@ -54,21 +61,167 @@ def safe_file_read(filepath, fallback_encoding:str='latin1') -> str:
         with open(filepath, "r", encoding=fallback_encoding) as file:
             return file.read()
         
-def get_token_count(text, disallowed_special=[], chunk_size=1000):
-    enc = tiktoken.get_encoding("cl100k_base")
+def print_token_table(console, token_table, max_rows=10):
+    # Show the files that take up the largest part of the context budget
+    table = Table(title=f"Largest {min(max_rows, len(token_table))} of {len(token_table)} files/sources by token count", title_style="bright_green")
+    table.add_column("File / source", style="bright_white")
+    table.add_column("Tokens", justify="right", style="bold bright_cyan")
+    for label, tokens in sorted(token_table.items(), key=lambda item: item[1], reverse=True)[:max_rows]:
+        table.add_row(label or "(outside of any source)", str(tokens))
+    console.print(table)
+
+def get_input_type(input_path):
+    """
+    Returns (str): The kind of input: 'git', 'youtube', 'arxiv', 'web', 'paper' (DOI or PMID) or 'folder'.
+    """
+    if GitMethods.is_local_repository(input_path) or "github.com" in input_path:
+        return 'git'
+    if urlparse(input_path).scheme in ["http", "https"]:
+        if "youtube.com" in input_path or "youtu.be" in input_path:
+            return 'youtube'
+        if "arxiv.org" in input_path:
+            return 'arxiv'
+        return 'web'
+    # Scientific papers from https://sci-hub.se/
+    if input_path.startswith("10.") and "/" in input_path or input_path.isdigit():
+        return 'paper'
+    return 'folder'
+
+def write_git_input(input_path, output_file, processed_file, snapshot_cache):
+    """
+    Flattens a git input to output_file, unless the snapshot cache has its commit.
 
-    # Remove XML tags
-    text_without_tags = re.sub(r'<[^>]+>', '', text)
+    Returns (tuple): The GitMethods object, the snapshot key (None without snapshot cache) and
+    whether both output files were restored from the snapshot cache.
+    """
+    gitmethods_object = GitMethods(url=input_path)
+    snapshot_key = gitmethods_object.get_snapshot_key() if config.use_snapshot_cache else None
+    if snapshot_key is not None and snapshot_cache.restore(snapshot_key, output_file, processed_file):
+        return gitmethods_object, snapshot_key, True
 
-    # Split the text into smaller chunks
-    chunks = [text_without_tags[i:i+chunk_size] for i in range(0, len(text_without_tags), chunk_size)]
-    total_tokens = 0
+    with open(output_file, "w", encoding="utf-8") as file:
+        file.write(gitmethods_object.handle_git_url())
+    return gitmethods_object, snapshot_key, False
 
-    for chunk in chunks:
-        tokens = enc.encode(chunk, disallowed_special=disallowed_special)
-        total_tokens += len(tokens)
-    
-    return total_tokens
+def write_input(input_path, output_file, input_type=None):
+    """
+    Writes the <source> elements of a non-git input to output_file, see get_input_type.
+    """
+    input_type = input_type or get_input_type(input_path)
+    if input_type == 'youtube':
+        with open(output_file, "w", encoding="utf-8") as file:
+            file.write(TranscriptionMethods(input_path).fetch_youtube_transcript())
+    elif input_type == 'arxiv':
+        # Streamed straight to the output file while the pages are extracted
+        PDFFileMethods().write_arxiv_pdf(input_path, output_file)
+    elif input_type == 'paper':
+        PDFFileMethods().write_doi_or_pmid(input_path, output_file)
+    elif input_type == 'folder':
+        # Local folder: streamed straight to the output file
+        FolderMethods(filepath=input_path).write_local_folder(output_file)
+    else:
+        # crawl_result = crawl_and_extract_text(input_path, max_depth=2, include_pdfs=True, ignore_epubs=True)
+        raise ValueError(f"Documentation URLs are not supported: {input_path}")
+
+def report_outputs(console, output_file, processed_file, token_counts=None):
+    """
+    Prints the token counts of the outputs and copies the uncompressed output to the clipboard.
+
+    token_counts are the counts returned by TextFileMethods.parse_text_as_xml (or kept in the snapshot cache),
+    the output files are only counted again without them.
+    """
+    if token_counts is None:
+        token_counts = count_file_tokens(output_file), count_file_tokens(processed_file)
+    (uncompressed_token_count, token_table), (compressed_token_count, _) = token_counts
+    console.print(f"\n[bright_green]Compressed Token Count:[/bright_green] [bold bright_cyan]{compressed_token_count}[/bold bright_cyan]")
+    console.print(f"[bright_green]Uncompressed Token Count:[/bright_green] [bold bright_cyan]{uncompressed_token_count}[/bold bright_cyan]\n")
+    print_token_table(console, token_table)
+
+    console.print(f"\n[bold bright_yellow]{processed_file}[/bold bright_yellow] and [bold bright_blue]{output_file}[/bold bright_blue] have been created in the working directory.")
+
+    pyperclip.copy(safe_file_read(output_file))
+    console.print(f"\n[bright_white]The contents of [bold bright_blue]{output_file}[/bold bright_blue] have been copied to the clipboard.[/bright_white]")
+
+def read_manifest(manifest_file):
+    # One path or URL per line, blank lines and lines starting with # are skipped
+    with open(manifest_file, 'r', encoding='utf-8') as file:
+        lines = [line.strip() for line in file]
+    return [line for line in lines if line and not line.startswith('#')]
+
+def batch_main(manifest_file, output_file="uncompressed_output.txt", processed_file="compressed_output.txt"):
+    """
+    Flattens every input of a manifest file into one output file.
+
+    The inputs are processed at the same time, at most config.batch_<input type>_inputs of a type
+    at once. Each input is written to a temporary file, and these are appended to output_file in manifest
+    order as soon as they are complete, inside a <sources> element. Inputs that fail are reported and left out.
+    """
+    console = Console()
+    inputs = read_manifest(manifest_file)
+    console.print(f"\n[bold bright_green]Processing {len(inputs)} inputs from[/bold bright_green] [bold bright_yellow]{manifest_file}[/bold bright_yellow]\n")
+    snapshot_cache = SnapshotCache(config.snapshot_cache_path, max_bytes=config.snapshot_cache_max_bytes)
+
+    def process_input(input_path, input_type, part_file):
+        start_time = time.perf_counter()
+        status = "done"
+        try:
+            if input_type == 'git':
+                _, snapshot_key, restored_from_cache = write_git_input(input_path, part_file, part_file + '.compressed', snapshot_cache)
+                if restored_from_cache:
+                    status = "snapshot cache"
+                elif snapshot_key is not None:
+                    token_counts = TextFileMethods.parse_text_as_xml(input_file=part_file, output_file=part_file + '.compressed')
+                    snapshot_cache.store(snapshot_key, part_file, part_file + '.compressed', token_counts)
+            else:
+                write_input(input_path, part_file, input_type)
+        except Exception as e:
+            status = f"failed: {e}"
+        duration = time.perf_counter() - start_time
+        console.print(f"[bright_blue]{input_path}[/bright_blue] {status} in {duration:.1f}s")
+        return status, duration
+
+    # One pool per input type, sized by its concurrency limit
+    input_types = [get_input_type(input_path) for input_path in inputs]
+    executors = {input_type: ThreadPoolExecutor(max_workers=getattr(config, f'batch_{input_type}_inputs')) for input_type in set(input_types)}
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir, open(output_file, 'wb') as output:
+            futures = [
+                executors[input_type].submit(process_input, input_path, input_type, os.path.join(temp_dir, f"{number}.txt"))
+                for number, (input_path, input_type) in enumerate(zip(inputs, input_types))
+            ]
+            # One root element around the <source> elements, so the combined output stays well-formed XML
+            output.write(b"<sources>\n")
+            for number, (input_path, input_type, future) in enumerate(zip(inputs, input_types, futures)):
+                status, duration = future.result()
+                part_file = os.path.join(temp_dir, f"{number}.txt")
+                size = 0
+                if not status.startswith("failed") and os.path.exists(part_file):
+                    size = os.path.getsize(part_file)
+                    with open(part_file, 'rb') as part:
+                        shutil.copyfileobj(part, output)
+                    output.write(b"\n")
+                    os.remove(part_file)
+                results.append((input_path, input_type, status, duration, size))
+            output.write(b"</sources>\n")
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+        PDFFileMethods.shutdown_pools()
+
+    table = Table(title=f"{len(inputs)} inputs", title_style="bright_green")
+    table.add_column("Input", style="bright_white")
+    table.add_column("Type")
+    table.add_column("Status")
+    table.add_column("Time (s)", justify="right", style="bold bright_cyan")
+    table.add_column("Size (KB)", justify="right", style="bold bright_cyan")
+    for input_path, input_type, status, duration, size in results:
+        table.add_row(input_path, input_type, status, f"{duration:.1f}", f"{size / 1024:.1f}")
+    console.print(table)
+
+    token_counts = TextFileMethods.parse_text_as_xml(input_file=output_file, output_file=processed_file)
+    report_outputs(console, output_file, processed_file, token_counts)
+    return results
 
 def main():
     console = Console()
@@ -77,6 +230,7 @@ def main():
     input_types = [
         ("• Local folder path (flattens all files into text)", "bright_white"),
         ("• GitHub repository URL (flattens all files into text)", "bright_white"),
+        ("• Local git repository: bare, file:// URL or clone, optionally followed by #<ref>", "bright_white"),
         ("• GitHub pull request URL (PR + Repo)", "bright_white"),
         ("• GitHub issue URL (Issue + Repo)", "bright_white"),
         ("• Documentation URL (base URL)", "bright_white"),
@@ -99,6 +253,9 @@ def main():
     console.print(intro_panel)
 
     # If an argument is passed, use it. Otherwise, prompt user to pass an argument
+    if len(sys.argv) > 2 and sys.argv[1] == "--manifest":
+        # Batch mode: python create_text_file.py --manifest inputs.txt
+        return batch_main(sys.argv[2])
     if len(sys.argv) > 1:
         input_path = sys.argv[1]
     else:
@@ -121,56 +278,33 @@ def main():
 
         # Parse the input path to call the correct function
         try:
+            snapshot_cache = SnapshotCache(config.snapshot_cache_path, max_bytes=config.snapshot_cache_max_bytes)
+            snapshot_key = None
+            restored_from_cache = False
+            token_counts = None
+
             # Git functions
-            if "github.com" in input_path:
-                gitmethods_object = GitMethods(url=input_path)
-                final_output = gitmethods_object.handle_git_url()
-
-            # URL functions
-            elif urlparse(input_path).scheme in ["http", "https"]:
-                if "youtube.com" in input_path or "youtu.be" in input_path:
-                    final_output = TranscriptionMethods.fetch_youtube_transcript(input_path)
-                elif "arxiv.org" in input_path:
-                    final_output = PDFFileMethods.process_arxiv_pdf(input_path)
-                # else:
-                #     crawl_result = crawl_and_extract_text(input_path, max_depth=2, include_pdfs=True, ignore_epubs=True)
-                #     final_output = crawl_result['content']
-                #     with open(urls_list_file, 'w', encoding='utf-8') as urls_file:
-                #         urls_file.write('\n'.join(crawl_result['processed_urls']))
-            
-            # Scientific papers from https://sci-hub.se/
-            elif input_path.startswith("10.") and "/" in input_path or input_path.isdigit():
-                final_output = PDFFileMethods.process_doi_or_pmid(input_path)
-            
-            # Local folder
+            if get_input_type(input_path) == 'git':
+                gitmethods_object, snapshot_key, restored_from_cache = write_git_input(input_path, output_file, processed_file, snapshot_cache)
+                if restored_from_cache:
+                    console.print(f"[bright_green]Commit {gitmethods_object.commit_sha} restored from the snapshot cache.[/bright_green]")
+                    token_counts = snapshot_cache.load_token_counts(snapshot_key)
+
+            # URL functions, scientific papers and local folders: streamed straight to the output file
             else:
-                folder_mathods_obj = FolderMethods(filepath=input_path)
-                final_output = folder_mathods_obj.process_local_folder()
+                write_input(input_path, output_file)
 
             progress.update(task, advance=50)
 
-            # Write the uncompressed output
-            with open(output_file, "w", encoding="utf-8") as file:
-                file.write(final_output)
-
-
             # Process the compressed output
-            TextFileMethods.parse_text_as_xml(input_file=output_file, output_file=processed_file)
+            if not restored_from_cache:
+                token_counts = TextFileMethods.parse_text_as_xml(input_file=output_file, output_file=processed_file)
+                if snapshot_key is not None:
+                    snapshot_cache.store(snapshot_key, output_file, processed_file, token_counts)
 
             progress.update(task, advance=50)
 
-            compressed_text = safe_file_read(processed_file)
-            compressed_token_count = get_token_count(compressed_text)
-            console.print(f"\n[bright_green]Compressed Token Count:[/bright_green] [bold bright_cyan]{compressed_token_count}[/bold bright_cyan]")
-
-            uncompressed_text = safe_file_read(output_file)
-            uncompressed_token_count = get_token_count(uncompressed_text)
-            console.print(f"[bright_green]Uncompressed Token Count:[/bright_green] [bold bright_cyan]{uncompressed_token_count}[/bold bright_cyan]")
-
-            console.print(f"\n[bold bright_yellow]{processed_file}[/bold bright_yellow] and [bold bright_blue]{output_file}[/bold bright_blue] have been created in the working directory.")
-
-            pyperclip.copy(uncompressed_text)
-            console.print(f"\n[bright_white]The contents of [bold bright_blue]{output_file}[/bold bright_blue] have been copied to the clipboard.[/bright_white]")
+            report_outputs(console, output_file, processed_file, token_counts)
 
         except Exception as e:
             console.print(f"\n[bold red]An error occurred:[/bold red] {str(e)}")
@@ -1,14 +1,28 @@
 # Import Python native packages
 import os
+import json
+import uuid
+import time
+import pickle
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
+import numpy as np
+
 # Import langchain methods
+import faiss
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 
 # Import project scripts
 from config import config
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from chunking import split_into_units, chunk_unit
+from faiss_index import build_index, save_index_params, load_index_params, open_vector_store, INDEX_FILE
+from chunk_store import ChunkStore, CHUNK_STORE_FILE
 
 # from sentence_transformers import SentenceTransformer
 
@@ -17,38 +31,330 @@ from config import config
 load_dotenv()
 huggingfacehub_api_token = os.getenv('HUGGINGFACEHUB_API_TOKEN')
 
+# Name of the file (inside the vector database folder) that tracks the indexed files
+MANIFEST_FILE = 'file_hashes.json'
+
 # Step 1: Read the file
 def read_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read()
 
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def hash_unit(unit):
+    return hash_text(unit['text'])
+
 # Step 2: Preprocess the data
-def preprocess_text(text):
-    # Clean and split the text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=300)
-    return text_splitter.split_text(text)
+def load_embeddings():
+    embeddings = HuggingFaceEmbeddings()
+    if not config.use_embedding_cache:
+        return embeddings
+
+    # Reuse the embeddings of chunks that were already embedded by the same model
+    cache = EmbeddingCache(config.embedding_cache_path, embeddings.model_name, max_entries=config.embedding_cache_max_entries)
+    return CachedEmbeddings(embeddings, cache)
+
+def close_embeddings(embeddings):
+    # Persist the embedding cache and report how many embeddings were reused
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings.cache.save()
+        embeddings.cache.report()
+
+def load_manifest(vector_db_path):
+    manifest_path = os.path.join(vector_db_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_manifest(vector_db_path, manifest):
+    with open(os.path.join(vector_db_path, MANIFEST_FILE), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1)
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Embedding model of a worker process, loaded once by _init_embedding_worker
+_worker_embeddings = None
+
+def _init_embedding_worker():
+    global _worker_embeddings
+    _worker_embeddings = HuggingFaceEmbeddings()
+
+def _embed_batch(texts):
+    return np.asarray(_worker_embeddings.embed_documents(texts), dtype=np.float32)
+
+def embed_batches(embeddings, batches):
+    """
+    Embeds batches of (text, metadata, id) chunks and yields (texts, metadatas, ids, vectors) per batch, in input order.
+
+    With config.embedding_workers > 1, the texts of every batch that are not in the embedding cache
+    are embedded by a pool of worker processes. At most two batches per worker are in flight,
+    so only a bounded number of chunks and vectors is held in memory at any time.
+    """
+    if config.embedding_workers <= 1:
+        for batch in batches:
+            texts, metadatas, ids = map(list, zip(*batch))
+            yield texts, metadatas, ids, embeddings.embed_documents(texts)
+        return
+
+    with ProcessPoolExecutor(max_workers=config.embedding_workers, initializer=_init_embedding_worker) as executor:
+        pending = deque()
+        for batch in batches:
+            texts, metadatas, ids = map(list, zip(*batch))
+            if isinstance(embeddings, CachedEmbeddings):
+                result, missing = embeddings.lookup(texts)
+                missing_texts = [texts[rows[0]] for rows in missing.values()]
+            else:
+                result, missing, missing_texts = None, None, texts
+            future = executor.submit(_embed_batch, missing_texts) if missing_texts else None
+            pending.append((texts, metadatas, ids, result, missing, future))
+
+            if len(pending) >= 2 * config.embedding_workers:
+                yield _finish_batch(embeddings, *pending.popleft())
+        while pending:
+            yield _finish_batch(embeddings, *pending.popleft())
+
+def _finish_batch(embeddings, texts, metadatas, ids, result, missing, future):
+    if future is None:
+        return texts, metadatas, ids, result
+    new_vectors = future.result()
+    if missing is None:
+        return texts, metadatas, ids, new_vectors
+    return texts, metadatas, ids, embeddings.complete(texts, result, missing, new_vectors)
+
+def create_trained_vector_store(embeddings, batches, sample=None):
+    """
+    Creates a vector store on the index type selected by config.faiss_index_type,
+    trains the index on the sample (by default the vectors of the given batches) and adds the batches.
+
+    The chunks go to a new chunk store next to the saved one, which replaces it in save_vector_store.
+    """
+    if sample is None:
+        sample = np.vstack([np.asarray(vectors, dtype=np.float32) for _, _, _, vectors in batches])
+    os.makedirs(config.vector_db_path, exist_ok=True)
+    store_path = os.path.join(config.vector_db_path, CHUNK_STORE_FILE + '.tmp')
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    store = ChunkStore(store_path)
+    vector_store = FAISS(embeddings, build_index(sample), store, store.index_to_docstore_id)
+    for texts, metadatas, ids, vectors in batches:
+        vector_store.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+    return vector_store
+
+def fill_ivf_vector_store(embeddings, chunks):
+    """
+    Creates an IVF vector store trained on a uniform random sample of the whole corpus, in one pass over the chunks.
+
+    Chunks come file by file, so the first chunks of the corpus would only cover the first files and the
+    IVF clusters trained on them would not fit the rest of the corpus. Every embedded batch is spooled to a
+    temporary file next to the vector database while a reservoir sample of config.faiss_train_size vectors
+    is kept. Once the index is trained on the sample, the batches are read back and added.
+    Only the sample and one batch are held in memory.
+
+    Returns: The vector store, or None if there were no chunks.
+    """
+    rng = np.random.default_rng(0)
+    sample, seen = None, 0
+    start_time = time.time()
+    os.makedirs(config.vector_db_path, exist_ok=True)
+    with tempfile.TemporaryFile(dir=config.vector_db_path) as spool:
+        for texts, metadatas, ids, vectors in embed_batches(embeddings, iter_batches(chunks, config.embedding_batch_size)):
+            vectors = np.asarray(vectors, dtype=np.float32)
+            pickle.dump((texts, metadatas, ids, vectors), spool)
+            if sample is None:
+                sample = np.empty((config.faiss_train_size, vectors.shape[1]), dtype=np.float32)
+            for vector in vectors:
+                # Reservoir sampling: every vector seen so far is in the sample with the same probability
+                row = seen if seen < len(sample) else rng.integers(seen + 1)
+                if row < len(sample):
+                    sample[row] = vector
+                seen += 1
+            print(f"Embedded {seen} chunks ({seen / (time.time() - start_time):.1f} chunks/s)")
+
+        if not seen:
+            return None
+
+        def iter_spooled_batches():
+            spool.seek(0)
+            while True:
+                try:
+                    yield pickle.load(spool)
+                except EOFError:
+                    return
+        return create_trained_vector_store(embeddings, iter_spooled_batches(), sample[:seen])
+
+def fill_vector_store(embeddings, chunks, vector_store=None):
+    """
+    Streams (text, metadata, id) chunks through the embedding pipeline and adds every batch
+    to the FAISS index as soon as it is embedded.
+
+    A new vector store is created from the first batch. For the trained index types (see faiss_index.py),
+    the first config.faiss_train_size vectors are held back until the index is trained on them.
+    The IVF index types are trained on a sample of the whole corpus instead (see fill_ivf_vector_store).
+
+    Returns: The vector store, or None if there were no chunks and no vector store was given.
+    """
+    if vector_store is None and config.faiss_index_type in ('ivf_flat', 'ivf_pq'):
+        return fill_ivf_vector_store(embeddings, chunks)
+    start_time = time.time()
+    total = 0
+    training_batches, training_size = [], 0
+    for texts, metadatas, ids, vectors in embed_batches(embeddings, iter_batches(chunks, config.embedding_batch_size)):
+        if vector_store is not None:
+            vector_store.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+        else:
+            training_batches.append((texts, metadatas, ids, vectors))
+            training_size += len(texts)
+            if config.faiss_index_type == 'flat' or training_size >= config.faiss_train_size:
+                vector_store = create_trained_vector_store(embeddings, training_batches)
+                training_batches = []
+
+        total += len(texts)
+        print(f"Embedded {total} chunks ({total / (time.time() - start_time):.1f} chunks/s)")
+
+    # The corpus is smaller than the training sample
+    if training_batches:
+        vector_store = create_trained_vector_store(embeddings, training_batches)
+    return vector_store
+
+def save_vector_store(vector_store):
+    """
+    Commits the chunk store and saves the FAISS index and its parameters next to it.
+    A newly built chunk store replaces the saved one.
+    """
+    store = vector_store.docstore
+    store.commit()
+    store_path = os.path.join(config.vector_db_path, CHUNK_STORE_FILE)
+    if store.path != store_path:
+        store.close()
+        os.replace(store.path, store_path)
+        store = ChunkStore(store_path)
+        store.optimize()
+        vector_store.docstore, vector_store.index_to_docstore_id = store, store.index_to_docstore_id
+
+    # Save the index locally. Written next to the saved index and moved into place: processes that
+    # memory-map index.faiss (index_load_mode='mmap') crash if the file they map is rewritten
+    index_path = os.path.join(config.vector_db_path, INDEX_FILE)
+    faiss.write_index(vector_store.index, index_path + '.tmp')
+    os.replace(index_path + '.tmp', index_path)
+    save_index_params(config.vector_db_path, vector_store.index)
+
+    # Chunks used to be pickled together with the index positions, see chunk_store.py
+    legacy_docstore_path = os.path.join(config.vector_db_path, 'index.pkl')
+    if os.path.exists(legacy_docstore_path):
+        os.remove(legacy_docstore_path)
 
 # Step 3: Vectorization and Indexing
-def create_vector_store(docs):
+def create_vector_store(chunks):
     # Use SentenceTransformer for embeddings
     # model = SentenceTransformer('all-MiniLM-L6-v2')
     # embeddings = model.encode(docs) #, convert_to_tensor=True)  # Generate embeddings for all documents
-    embeddings = HuggingFaceEmbeddings()
-    text_embeddings = embeddings.embed_documents(docs)
-    text_embedding_pairs = zip(docs, text_embeddings)
-    vector_store = FAISS.from_embeddings(text_embedding_pairs, embeddings)
+    embeddings = load_embeddings()
+    vector_store = fill_vector_store(embeddings, chunks)
+    if vector_store is None:
+        print("No text found to index.")
+        return None
 
-    vector_store.save_local("vector_database")  # Save the index locally
+    save_vector_store(vector_store)
+    close_embeddings(embeddings)
+    return vector_store
+
+def iter_unit_chunks(units, keys, entries):
+    """
+    Chunks the given units and assigns a new id to every chunk.
+
+    Yields (tuple): The chunk text, its metadata and its id. The manifest entry of every chunked unit is added to entries.
+    """
+    for key in keys:
+        unit_ids = []
+        entries[key] = {'hash': hash_unit(units[key]), 'ids': unit_ids}
+        for doc in chunk_unit(units[key], max_tokens=config.chunk_max_tokens):
+            unit_ids.append(str(uuid.uuid4()))
+            yield doc.page_content, doc.metadata, unit_ids[-1]
+
+def update_vector_store(units, manifest):
+    """
+    Updates the saved vector database in place, only re-embedding the units whose hash changed.
+
+    Chunks of changed and deleted units are removed from the FAISS index and the docstore,
+    chunks of new and changed units are embedded and added.
+    """
+    indexed_files = manifest['files']
+    changed_keys = [key for key, unit in units.items() if indexed_files.get(key, {}).get('hash') != hash_unit(unit)]
+    deleted_keys = [key for key in indexed_files if key not in units]
+
+    if not changed_keys and not deleted_keys:
+        print("Vector database is up to date, nothing to re-index.")
+        return None
+
+    # Drop the chunks of the outdated units from the index and the docstore
+    stale_ids = [chunk_id for key in changed_keys + deleted_keys for chunk_id in indexed_files.get(key, {}).get('ids', [])]
+    index_params = load_index_params(config.vector_db_path)
+    index_type = index_params['index_type']
+    # A small corpus can get a flat index in place of the requested type (see build_index), that is no reason to rebuild
+    requested_index_type = index_params.get('requested_index_type', index_type)
+    if requested_index_type != config.faiss_index_type or (stale_ids and index_type != 'flat'):
+        # HNSW can't remove vectors and IVF keeps the ids of removed vectors, while the FAISS wrapper
+        # renumbers them. Rebuild instead: the embedding cache still holds the vectors of the unchanged files.
+        print(f"Cannot update the {index_type} index in place, rebuilding it as {config.faiss_index_type}...")
+        return rebuild_vector_store(units)
+
+    print(f"Re-indexing {len(changed_keys)} changed file(s), removing {len(deleted_keys)} deleted file(s)...")
+    embeddings = load_embeddings()
+    vector_store = open_vector_store(embeddings, config.vector_db_path, read_only=False)
+
+    if stale_ids:
+        # Remove the vectors, then the chunks: the chunk store shifts the positions like IndexFlat.remove_ids does
+        vector_store.index.remove_ids(np.array(vector_store.docstore.get_positions(stale_ids), dtype=np.int64))
+        vector_store.docstore.delete(stale_ids)
+    for key in deleted_keys:
+        del indexed_files[key]
+
+    # Embed and add the chunks of the new and changed units
+    entries = {}
+    fill_vector_store(embeddings, iter_unit_chunks(units, changed_keys, entries), vector_store)
+    indexed_files.update(entries)
+
+    save_vector_store(vector_store)
+    close_embeddings(embeddings)
+    save_manifest(config.vector_db_path, manifest)
+    return vector_store
+
+def rebuild_vector_store(units):
+    # Full build that also writes the manifest used by the next incremental run
+    entries = {}
+    vector_store = create_vector_store(iter_unit_chunks(units, list(units), entries))
+    if vector_store is not None:
+        save_manifest(config.vector_db_path, {'files': entries})
+    elif os.path.exists(os.path.join(config.vector_db_path, MANIFEST_FILE)):
+        # Nothing was indexed, the manifest may not describe the saved index any more
+        os.remove(os.path.join(config.vector_db_path, MANIFEST_FILE))
     return vector_store
 
 # Main function to run the program
 def main():
-    text_folder = config.text_file_path
     file_path = 'uncompressed_output.txt'
     text = read_file(file_path)
-    docs = preprocess_text(text)
-    vector_store = create_vector_store(docs)
+
+    # Split the text into units that follow the <source>/<file> structure, see chunking.py
+    units = split_into_units(text)
+    manifest = load_manifest(config.vector_db_path)
+    saved_files = (INDEX_FILE, CHUNK_STORE_FILE)
+    if config.incremental_indexing and manifest is not None and all(os.path.exists(os.path.join(config.vector_db_path, name)) for name in saved_files):
+        update_vector_store(units, manifest)
+    else:
+        # Full builds write the manifest too, so a later incremental run starts from the saved index
+        rebuild_vector_store(units)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
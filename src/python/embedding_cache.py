@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache():
+    """
+    Content-addressed, on-disk cache of chunk embeddings for one embedding model.
+
+    The vectors are stored in a memory-mapped float32 array (vectors.f32) and an index file
+    (index.json) maps every chunk hash to its row in that array. The index keeps the keys in
+    least-recently-used order, so the oldest entries are evicted once max_entries is reached
+    and their rows are reused for new embeddings, once the index without them is saved.
+    """
+    VECTORS_FILE = 'vectors.f32'
+    INDEX_FILE = 'index.json'
+    # Share of max_entries evicted at once when the cache is full, each eviction saves the index
+    EVICTION_FRACTION = 10
+
+    def __init__(self, cache_dir, model_name, max_entries=200000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.cache_path = os.path.join(cache_dir, re.sub(r'[^a-zA-Z0-9_.-]+', '_', model_name))
+        self.hits = 0
+        self.misses = 0
+
+        self.dim = None
+        self.capacity = 0
+        self.slots = OrderedDict()
+        self.free_slots = []
+        self.vectors = None
+
+        index_path = os.path.join(self.cache_path, self.INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+            self.dim = index['dim']
+            self.capacity = index['capacity']
+            self.slots = OrderedDict(index['slots'])
+            used_slots = set(self.slots.values())
+            self.free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used_slots]
+            self.vectors = np.memmap(os.path.join(self.cache_path, self.VECTORS_FILE), dtype=np.float32, mode='r+', shape=(self.capacity, self.dim))
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, chunk_hash):
+        """
+        Returns the cached embedding as a read-only view on the memory-mapped array, or None.
+        """
+        slot = self.slots.get(chunk_hash)
+        if slot is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.slots.move_to_end(chunk_hash)
+        vector = self.vectors[slot]
+        vector.flags.writeable = False
+        return vector
+
+    def put(self, chunk_hash, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vector.shape[0]
+
+        slot = self.slots.get(chunk_hash)
+        if slot is None:
+            slot = self._take_slot()
+            self.slots[chunk_hash] = slot
+        self.slots.move_to_end(chunk_hash)
+        self.vectors[slot] = vector
+
+    def _take_slot(self):
+        if not self.free_slots:
+            if self.capacity < self.max_entries:
+                self._grow(min(self.max_entries, max(1024, self.capacity * 2)))
+            else:
+                self._evict(max(1, self.max_entries // self.EVICTION_FRACTION))
+        return self.free_slots.pop()
+
+    def _evict(self, count):
+        # Evict the least recently used embeddings. The index is saved without them before their rows are
+        # reused, so an interrupted run never leaves a saved hash pointing at the vector of another chunk.
+        for _ in range(min(count, len(self.slots))):
+            _, slot = self.slots.popitem(last=False)
+            self.free_slots.append(slot)
+        self.save()
+
+    def _grow(self, new_capacity):
+        os.makedirs(self.cache_path, exist_ok=True)
+        vectors_path = os.path.join(self.cache_path, self.VECTORS_FILE)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+
+        # Extend the backing file, the rows already written keep their offsets
+        with open(vectors_path, 'ab') as file:
+            file.truncate(new_capacity * self.dim * np.dtype(np.float32).itemsize)
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode='r+', shape=(new_capacity, self.dim))
+
+        self.free_slots = list(range(new_capacity - 1, self.capacity - 1, -1)) + self.free_slots
+        self.capacity = new_capacity
+
+    def save(self):
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+
+        index_path = os.path.join(self.cache_path, self.INDEX_FILE)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'model_name': self.model_name, 'dim': self.dim, 'capacity': self.capacity, 'slots': list(self.slots.items())}, file)
+        os.replace(index_path + '.tmp', index_path)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        print(f"Embedding cache ({self.model_name}): {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {len(self.slots)} cached embeddings.")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embedding model and only embeds the texts that are missing from the cache.
+    """
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        """
+        Returns the embeddings of the texts as one float32 array, one row per text.
+        """
+        result, missing = self.lookup(texts)
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[rows[0]] for rows in missing.values()])
+            result = self.complete(texts, result, missing, new_vectors)
+        return result
+
+    def lookup(self, texts):
+        """
+        Looks up the texts in the cache.
+
+        Returns (tuple): The array with the cached rows filled in (None when nothing was cached)
+        and the hashes of the missing texts mapped to their row numbers.
+        """
+        result = None
+        missing = OrderedDict()
+        for i, text in enumerate(texts):
+            chunk_hash = self.cache.hash_text(text)
+            vector = self.cache.get(chunk_hash)
+            if vector is None:
+                missing.setdefault(chunk_hash, []).append(i)
+                continue
+            if result is None:
+                result = np.empty((len(texts), vector.shape[0]), dtype=np.float32)
+            result[i] = vector
+
+        if result is None and not missing:
+            result = np.empty((0, self.cache.dim or 0), dtype=np.float32)
+        return result, missing
+
+    def complete(self, texts, result, missing, new_vectors):
+        """
+        Fills in (and caches) the embeddings of the missing texts, in the order of lookup's missing dict.
+        """
+        for (chunk_hash, rows), vector in zip(missing.items(), new_vectors):
+            if result is None:
+                result = np.empty((len(texts), len(vector)), dtype=np.float32)
+            result[rows] = vector
+            self.cache.put(chunk_hash, vector)
+        return result
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,134 @@
+import os
+import json
+import math
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from config import config
+from chunk_store import ChunkStore, CHUNK_STORE_FILE
+
+# Names of the files (inside the vector database folder) holding the index and the parameters it was built with
+INDEX_FILE = 'index.faiss'
+INDEX_PARAMS_FILE = 'index_params.json'
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+
+def get_nlist(num_vectors):
+    # Number of IVF clusters: the configured value, or ~4 * sqrt(n) while keeping at least 39 training points per cluster
+    if config.faiss_nlist:
+        return config.faiss_nlist
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def build_index(sample):
+    """
+    Creates the FAISS index selected by config.faiss_index_type and trains it on the sample.
+
+    Args:
+    sample (np.ndarray): float32 embeddings of shape (n, dim) to train the index on.
+
+    Returns: The trained (empty) index. Falls back to a flat index if the sample is too small to train on.
+    """
+    num_vectors, dim = sample.shape
+    index_type = config.faiss_index_type
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown faiss_index_type '{index_type}', choose one of {', '.join(INDEX_TYPES)}")
+
+    if index_type == 'hnsw':
+        index = faiss.index_factory(dim, f"HNSW{config.faiss_hnsw_m},Flat")
+        index.hnsw.efConstruction = config.faiss_ef_construction
+        return index
+
+    if index_type == 'ivf_flat':
+        index = faiss.index_factory(dim, f"IVF{get_nlist(num_vectors)},Flat")
+    elif index_type == 'ivf_pq':
+        if num_vectors < 2 ** config.faiss_pq_nbits or dim % config.faiss_pq_m:
+            print(f"Cannot train IVF-PQ on {num_vectors} vectors of dimension {dim}, using a flat index.")
+            return faiss.IndexFlatL2(dim)
+        index = faiss.index_factory(dim, f"IVF{get_nlist(num_vectors)},PQ{config.faiss_pq_m}x{config.faiss_pq_nbits}")
+    else:
+        return faiss.IndexFlatL2(dim)
+
+    print(f"Training {index_type} index on {num_vectors} vectors...")
+    index.train(sample)
+    return index
+
+
+def get_index_type(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    return 'flat'
+
+
+def save_index_params(vector_db_path, index):
+    index_type = get_index_type(index)
+    # The requested type is kept too, the index falls back to flat when the corpus is too small to train it
+    params = {'index_type': index_type, 'requested_index_type': config.faiss_index_type, 'dim': index.d, 'ntotal': index.ntotal}
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        params['nlist'] = index.nlist
+    if index_type == 'ivf_pq':
+        params.update(pq_m=index.pq.M, pq_nbits=index.pq.nbits)
+    if index_type == 'hnsw':
+        params.update(hnsw_m=config.faiss_hnsw_m, ef_construction=index.hnsw.efConstruction)
+
+    params_path = os.path.join(vector_db_path, INDEX_PARAMS_FILE)
+    with open(params_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(params, file, indent=1)
+    os.replace(params_path + '.tmp', params_path)
+
+
+def load_index_params(vector_db_path):
+    params_path = os.path.join(vector_db_path, INDEX_PARAMS_FILE)
+    if not os.path.exists(params_path):
+        return {'index_type': 'flat'}
+    with open(params_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def apply_search_parameters(index, index_type, nprobe=None, ef_search=None):
+    """
+    Sets the query-time parameters of an index, no rebuild needed: nprobe for IVF indexes, efSearch for HNSW.
+    """
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        faiss.extract_index_ivf(index).nprobe = nprobe or config.faiss_nprobe
+    elif index_type == 'hnsw':
+        index.hnsw.efSearch = ef_search or config.faiss_ef_search
+
+
+def read_index_mmap(index_path, index_type):
+    """
+    Reads a saved index without loading its vectors: they are memory-mapped from the file and paged in on demand.
+
+    IVF inverted lists are mapped with IO_FLAG_MMAP, the codes of flat and HNSW indexes with IO_FLAG_MMAP_IFC
+    (only in newer FAISS releases, older ones read them into memory).
+    """
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    else:
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    return faiss.read_index(index_path, flags)
+
+
+def open_vector_store(embeddings, vector_db_path, read_only=True, mmap=False):
+    """
+    Opens a saved vector database: the FAISS index and its chunk store.
+
+    Args:
+    embeddings (Embeddings): Model used to embed the queries (and new chunks).
+    vector_db_path (str): Folder of the vector database.
+    read_only (bool): Open the chunk store read-only (and memory-mapped).
+    mmap (bool): Memory-map the index instead of reading it into memory, see read_index_mmap.
+
+    Returns (FAISS): The LangChain vector store, with the query-time parameters of the index applied.
+    """
+    index_type = load_index_params(vector_db_path)['index_type']
+    index_path = os.path.join(vector_db_path, INDEX_FILE)
+    index = read_index_mmap(index_path, index_type) if mmap else faiss.read_index(index_path)
+    store = ChunkStore(os.path.join(vector_db_path, CHUNK_STORE_FILE), read_only=read_only)
+    apply_search_parameters(index, index_type)
+    return FAISS(embeddings, index, store, store.index_to_docstore_id)
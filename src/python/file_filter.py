@@ -0,0 +1,184 @@
+import re
+
+from generic_functions import is_allowed_filetype
+from config import config
+
+# Directories that are never flattened: version control metadata, dependencies, virtual environments,
+# caches and build outputs. Uses the .gitignore syntax, like config.ignore_patterns.
+DEFAULT_IGNORE_PATTERNS = (
+    '.git/', '.hg/', '.svn/',
+    'node_modules/', 'bower_components/',
+    'venv/', '.venv/', 'site-packages/',
+    '__pycache__/', '.mypy_cache/', '.pytest_cache/', '.ruff_cache/', '.tox/', '.nox/',
+    'build/', 'dist/', '*.egg-info/', '.next/',
+)
+
+# Bytes read to decide whether a file is binary, the same amount git looks at
+BINARY_SNIFF_SIZE = 8000
+
+
+def translate_pattern(pattern):
+    """
+    Translates the glob of a .gitignore line into a regular expression body.
+
+    * and ? do not match /, ** matches any number of directories and [...] is a character class.
+    """
+    parts = []
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if pattern.startswith('**/', position):
+            parts.append('(?:.*/)?')
+            position += 3
+            continue
+        if pattern.startswith('**', position):
+            parts.append('.*')
+            position += 2
+            continue
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[' and ']' in pattern[position + 2:]:
+            end = pattern.index(']', position + 2)
+            characters = pattern[position + 1:end]
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            parts.append(f"[{characters}]")
+            position = end
+        elif char == '\\' and position + 1 < len(pattern):
+            position += 1
+            parts.append(re.escape(pattern[position]))
+        else:
+            parts.append(re.escape(char))
+        position += 1
+    return ''.join(parts)
+
+
+def compile_rule(line):
+    """
+    Compiles one .gitignore line.
+
+    Returns (tuple): The regular expression, whether the rule re-includes paths (!pattern) and
+    whether it only applies to directories (pattern/). None for blank lines and comments.
+    """
+    line = line.rstrip('\n').rstrip()
+    if not line or line.startswith('#'):
+        return None
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    directory_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+
+    # Patterns with a slash are relative to the .gitignore folder, others match a name at any depth
+    prefix = '' if '/' in line else '(?:.*/)?'
+    return re.compile(f"{prefix}{translate_pattern(line.lstrip('/'))}"), negate, directory_only
+
+
+class IgnoreRules():
+    """
+    The rules of one .gitignore file (or list of patterns), applied to the paths below its folder.
+
+    As in git, the last matching rule decides. Rule sets without ! rules are combined into one
+    regular expression per kind (files and directories).
+    """
+    def __init__(self, lines, base=''):
+        self.base = base.strip('/')
+        self.rules = [rule for rule in map(compile_rule, lines) if rule is not None]
+        self.has_negation = any(negate for _, negate, _ in self.rules)
+        if not self.has_negation:
+            self.file_pattern = self.combine(rule for rule in self.rules if not rule[2])
+            self.directory_pattern = self.combine(self.rules)
+
+    @staticmethod
+    def combine(rules):
+        patterns = [regex.pattern for regex, _, _ in rules]
+        return re.compile('|'.join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+    def match(self, path, is_dir):
+        """
+        Returns (bool): True if the path is ignored, False if it is re-included, None if no rule matches.
+        """
+        if self.base:
+            if not path.startswith(self.base + '/'):
+                return None
+            path = path[len(self.base) + 1:]
+
+        if not self.has_negation:
+            pattern = self.directory_pattern if is_dir else self.file_pattern
+            return True if pattern is not None and pattern.fullmatch(path) else None
+
+        for regex, negate, directory_only in reversed(self.rules):
+            if (is_dir or not directory_only) and regex.fullmatch(path):
+                return not negate
+        return None
+
+
+class FileFilter():
+    """
+    Decides which files of a folder or git tree are flattened.
+
+    A file is included when its suffix is allowed, neither it nor one of its folders is ignored
+    (DEFAULT_IGNORE_PATTERNS, config.ignore_patterns and the .gitignore files of the folder),
+    it is at most max_file_size bytes and its first bytes contain no NUL byte.
+    Paths are relative to the root of the folder or tree and use / as separator.
+    """
+    def __init__(self, ignore_patterns=None, max_file_size=None, use_gitignore=None):
+        self.max_file_size = max_file_size if max_file_size is not None else config.max_file_size
+        self.use_gitignore = use_gitignore if use_gitignore is not None else config.use_gitignore
+        self.patterns = list(DEFAULT_IGNORE_PATTERNS) + list(config.ignore_patterns if ignore_patterns is None else ignore_patterns)
+        self.rule_sets = [IgnoreRules(self.patterns)]
+        # Decisions for the folders seen so far, so every folder of a tree listing is matched once
+        self.ignored_directories = {'': False}
+
+    def add_gitignore(self, gitignore_path, base=''):
+        # Rules of a .gitignore file found in the folder base, they are applied after the rules of its parents
+        if not self.use_gitignore:
+            return
+        with open(gitignore_path, 'r', encoding='utf-8', errors='ignore') as file:
+            self.rule_sets.append(IgnoreRules(file.readlines(), base))
+
+    def is_ignored(self, path, is_dir=False):
+        ignored = False
+        for rule_set in self.rule_sets:
+            result = rule_set.match(path, is_dir)
+            if result is not None:
+                ignored = result
+        return ignored
+
+    def include_directory(self, path):
+        """
+        Returns (bool): True if the walk should descend into the folder. Its parents are assumed included.
+        """
+        if path not in self.ignored_directories:
+            self.ignored_directories[path] = self.is_ignored(path, is_dir=True)
+        return not self.ignored_directories[path]
+
+    def include_file(self, path, size=None):
+        """
+        Checks a file of a walk (whose folder is included) on its suffix, ignore rules and size, if known.
+        """
+        if not is_allowed_filetype(path):
+            return False
+        if size is not None and size > self.max_file_size:
+            return False
+        return not self.is_ignored(path)
+
+    def include_path(self, path, size=None):
+        """
+        Checks a file of a tree listing: like include_file, and none of its folders may be ignored.
+        """
+        folders = path.split('/')[:-1]
+        for depth in range(1, len(folders) + 1):
+            if not self.include_directory('/'.join(folders[:depth])):
+                return False
+        return self.include_file(path, size)
+
+    def include_content(self, content):
+        """
+        Returns (bool): False for raw file contents that are too large or look binary (contain a NUL byte).
+        """
+        return len(content) <= self.max_file_size and b'\0' not in content[:BINARY_SNIFF_SIZE]
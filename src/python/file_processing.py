@@ -1,10 +1,21 @@
+import io
 import re
 import os
+import json
+import hashlib
+import tempfile
+import threading
+import multiprocessing
 import requests
-import wget
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from generic_functions import get_stopword_list, escape_xml, is_allowed_filetype, process_ipynb_file, download_file
+from generic_functions import get_stopword_list, escape_xml, is_allowed_filetype, process_ipynb_file, process_ipynb_text, download_file, decode_file_content
 from git_methods import GitMethods
+from file_filter import FileFilter
+from config import config
+from pdf_extraction import extract_pages, extract_pdf_file_pages
+from token_counting import TokenCounter
 
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup
@@ -13,20 +24,39 @@ from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import TextFormatter
 
 
+# Characters that are kept by TextFileMethods.clean_text
+UNWANTED_CHARACTERS_PATTERN = re.compile(r"[^a-zA-Z0-9\s_.,!?:;@#$%^&*()+\-=[\]{}|\\<>`~'\"/]+")
+
+def escape_xml_text(text):
+    # Same escaping as xml.etree.ElementTree uses for element text
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def escape_xml_attribute(value):
+    # Same escaping as xml.etree.ElementTree uses for attribute values
+    return (
+        escape_xml_text(value)
+        .replace("\"", "&quot;")
+        .replace("\r", "&#13;")
+        .replace("\n", "&#10;")
+        .replace("\t", "&#09;")
+    )
+
+def write_fragments(fragments, output_file):
+    # Stream text fragments to the output file as they are produced
+    with open(output_file, "w", encoding="utf-8") as file:
+        for fragment in fragments:
+            file.write(fragment)
+
 class TextFileMethods():
+    # Size of the pieces the input file is read in and the output buffer is flushed at
+    STREAM_CHUNK_SIZE = 1024 * 1024
 
     @staticmethod
     def clean_text(text):
-        # Remove new-line characters
-        text = re.sub(r"[\n\r]+", "\n", text)
         # Remove unwanted characters
-        text = re.sub(r"[^a-zA-Z0-9\s_.,!?:;@#$%^&*()+\-=[\]{}|\\<>`~'\"/]+", "", text)
-        # Normalize Whitespace
-        text = re.sub(r"\s+", " ", text)
-        # Convert to Lowercase
-        text = text.lower()
-        # Split into words
-        words = text.split()
+        text = UNWANTED_CHARACTERS_PATTERN.sub("", text)
+        # Convert to Lowercase and split into words (this also normalizes new-lines and whitespace)
+        words = text.lower().split()
 
         # Drop stop words (the, is, in...)
         stop_words = get_stopword_list()
@@ -36,154 +66,424 @@ class TextFileMethods():
 
     @staticmethod
     def parse_text_as_xml(input_file, output_file):
-        with open(input_file, "r", encoding="utf-8") as input_file:
-            input_text = input_file.read()
+        """
+        Compresses input_file to output_file, and counts the tokens of both while they are streamed.
 
+        Returns (tuple): The token counts (see token_counting.count_tokens) of the input and of the output.
+        """
+        input_counter, output_counter = TokenCounter(), TokenCounter()
         try:
             # Try to parse the input as XML
-            root = ET.fromstring(input_text)
-
-            # Process text content while preserving XML structure
-            for elem in root.iter():
-                if elem.text:
-                    elem.text = TextFileMethods.clean_text(elem.text)
-                if elem.tail:
-                    elem.tail = TextFileMethods.clean_text(elem.tail)
-
-            # Write the processed XML to the output file
-            tree = ET.ElementTree(root)
-            tree.write(output_file, encoding="utf-8", xml_declaration=True)
+            TextFileMethods.compress_xml_stream(input_file, output_file, input_counter, output_counter)
             print("Text preprocessing completed with XML structure preserved.")
         except ET.ParseError:
-            # If XML parsing fails, process the text without preserving XML structure
-            processed_text = TextFileMethods.clean_text(input_text)
-            with open(output_file, "w", encoding="utf-8") as out_file:
-                out_file.write(processed_text)
-            Warning("XML parsing failed. Text preprocessing completed without XML structure.")
-
-class PDFFileMethods():
+            # If XML parsing fails, process the text without preserving XML structure (the input is read again)
+            input_counter, output_counter = TokenCounter(), TokenCounter()
+            TextFileMethods.compress_text_stream(input_file, output_file, input_counter, output_counter)
+            print("XML parsing failed. Text preprocessing completed without XML structure.")
+        return input_counter.count(), output_counter.count()
 
-    def add_xml_tags_for_paper(self, text):
-        paper_xml_formatted_text = '<paper>\n'
-        paper_xml_formatted_text += escape_xml(' '.join(text))
-        paper_xml_formatted_text += '\n</paper>\n'
+    @staticmethod
+    def compress_xml_stream(input_file, output_file, input_counter=None, output_counter=None):
+        """
+        Cleans the text of every element while preserving the XML structure, using an incremental parser.
 
-        return paper_xml_formatted_text
+        The input is read and the output written in chunks, and every element is dropped from memory
+        once its text and tail are written, so memory stays bounded whatever the size of the input.
+        The output is identical to cleaning a fully parsed tree and writing it with ElementTree.write.
+        The chunks read and written are fed to input_counter and output_counter (TokenCounter), if given.
 
-    def process_pdf(self, url):
-        # Download PDF content
-        response = requests.get(url)
-        response.raise_for_status()
-        content = response.content
-
-        with open('temp.pdf', 'wb') as pdf_file:
-            pdf_file.write(content)
+        Raises:
+        ET.ParseError: If the input is not well-formed XML. The output file is then incomplete.
+        """
+        parser = ET.XMLPullParser(events=("start", "end"))
+        # Open elements, as [element, last closed child]
+        stack = []
+        buffer = []
+        buffered_size = 0
+        # Start tag of the last opened element still misses its ">" (or " />" if it stays empty)
+        start_tag_open = False
+
+        with open(input_file, "r", encoding="utf-8") as in_file, open(output_file, "w", encoding="utf-8", errors="xmlcharrefreplace") as out_file:
+            def write(text):
+                out_file.write(text)
+                if output_counter is not None:
+                    output_counter.feed(text)
+
+            write("<?xml version='1.0' encoding='utf-8'?>\n")
+
+            def handle_events():
+                nonlocal start_tag_open, buffered_size
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        if stack:
+                            parent, last_child = stack[-1]
+                            if start_tag_open:
+                                buffer.append(">")
+                            # The text before this element is complete: the parent's text or the previous sibling's tail
+                            text = TextFileMethods.clean_text((last_child.tail if last_child is not None else parent.text) or "")
+                            if text:
+                                buffer.append(escape_xml_text(text))
+
+                        buffer.append("<" + elem.tag)
+                        for key, value in elem.items():
+                            buffer.append(f' {key}="{escape_xml_attribute(value)}"')
+                        start_tag_open = True
+                        stack.append([elem, None])
+                    else:
+                        _, last_child = stack.pop()
+                        text = TextFileMethods.clean_text((last_child.tail if last_child is not None else elem.text) or "")
+                        if last_child is None and not text:
+                            buffer.append(" />")
+                        else:
+                            if start_tag_open:
+                                buffer.append(">")
+                            if text:
+                                buffer.append(escape_xml_text(text))
+                            buffer.append(f"</{elem.tag}>")
+                        start_tag_open = False
+
+                        # Only the closed element is still needed (for its tail), release its earlier siblings and children
+                        del elem[:]
+                        if stack:
+                            parent = stack[-1][0]
+                            del parent[:-1]
+                            stack[-1][1] = elem
+                    buffered_size += 1
+
+                if buffered_size >= 10000:
+                    write("".join(buffer))
+                    buffer.clear()
+                    buffered_size = 0
+
+            while True:
+                chunk = in_file.read(TextFileMethods.STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if input_counter is not None:
+                    input_counter.feed(chunk)
+                parser.feed(chunk)
+                handle_events()
+            parser.close()
+            handle_events()
+            write("".join(buffer))
 
-        text = []
-        with open('temp.pdf', 'rb') as pdf_file:
-            pdf_reader = PdfReader(pdf_file)
-            for page in range(len(pdf_reader.pages)):
-                text.append(pdf_reader.pages[page].extract_text())
+    @staticmethod
+    def compress_text_stream(input_file, output_file, input_counter=None, output_counter=None):
+        """
+        Cleans the input as plain text, reading and writing it in chunks.
 
-        os.remove('temp.pdf')
-        return ' '.join(text)
+        Chunks are cut at whitespace, so the output is identical to cleaning the whole text at once.
+        The chunks read and written are fed to input_counter and output_counter (TokenCounter), if given.
+        """
+        with open(input_file, "r", encoding="utf-8") as in_file, open(output_file, "w", encoding="utf-8") as out_file:
+            remainder = ""
+            separator = ""
+            while True:
+                chunk = in_file.read(TextFileMethods.STREAM_CHUNK_SIZE)
+                if input_counter is not None:
+                    input_counter.feed(chunk)
+                text = remainder + chunk
+                if chunk:
+                    # Keep the (possibly incomplete) last word for the next chunk
+                    cut = len(text)
+                    while cut > 0 and not text[cut - 1].isspace():
+                        cut -= 1
+                    text, remainder = text[:cut], text[cut:]
+
+                cleaned_text = TextFileMethods.clean_text(text)
+                if cleaned_text:
+                    out_file.write(separator + cleaned_text)
+                    if output_counter is not None:
+                        output_counter.feed(separator + cleaned_text)
+                    separator = " "
+                if not chunk:
+                    break
 
-    def process_arxiv_pdf(self, arxiv_abs_url):
-        pdf_url = arxiv_abs_url.replace("/abs/", "/pdf/") + ".pdf"
-        text = self.process_pdf(pdf_url)
+class PDFFileMethods():
+    """
+    Downloads papers into memory and extracts their text with a pool of worker processes, a range of pages per task.
+    Papers shorter than config.pdf_parallel_min_pages are extracted in this process, and the pool is shared
+    by all papers of the process (e.g. the inputs of create_text_file's batch mode).
+
+    The pages are yielded in order as soon as they are extracted, and the extracted text is cached
+    by the SHA-256 of the PDF content, so the same paper is never parsed twice.
+    """
+    # Number of pages extracted per worker task
+    PAGES_PER_TASK = 16
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 6.3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36',
+        'Connection': 'keep-alive'
+    }
+
+    # Worker pools by number of workers, see get_pool
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, workers=None, cache_path=None):
+        # Number of worker processes extracting pages, 1 extracts them in this process
+        self.workers = workers or config.pdf_workers
+        self.cache_path = cache_path or config.pdf_cache_path
+
+    @classmethod
+    def get_pool(cls, workers):
+        """
+        Returns (ProcessPoolExecutor): The pool of worker processes of this size, started on first use.
 
-        formatted_text = f'<source type="arxiv_paper" url="{arxiv_abs_url}">\n'
-        formatted_text += self.add_xml_tags_for_paper(text)
-        formatted_text += '</source>'
+        Workers are forked from a fork server where available, spawned otherwise: forking this process
+        while other threads run (batch mode of create_text_file) can deadlock.
+        """
+        with cls._pools_lock:
+            if workers not in cls._pools:
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                cls._pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+            return cls._pools[workers]
+
+    @classmethod
+    def shutdown_pools(cls):
+        with cls._pools_lock:
+            for pool in cls._pools.values():
+                pool.shutdown()
+            cls._pools.clear()
 
-        os.remove('temp.pdf')
-        print("ArXiv paper processed successfully.")
+    @staticmethod
+    def download_pdf(url, headers=None):
+        # Stream the download into an in-memory buffer instead of a temporary file
+        buffer = io.BytesIO()
+        with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            for block in response.iter_content(chunk_size=1024 * 1024):
+                buffer.write(block)
+        return buffer.getvalue()
+
+    def load_cached_pages(self, content_hash):
+        cache_file = os.path.join(self.cache_path, f"{content_hash}.json")
+        if not os.path.exists(cache_file):
+            return None
+        with open(cache_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def store_cached_pages(self, content_hash, pages):
+        os.makedirs(self.cache_path, exist_ok=True)
+        cache_file = os.path.join(self.cache_path, f"{content_hash}.json")
+        with open(cache_file + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(pages, file)
+        os.replace(cache_file + '.tmp', cache_file)
+
+    def iter_pdf_pages(self, pdf_bytes):
+        """
+        Yields (str): The text of every page of the PDF, in order.
+        """
+        content_hash = hashlib.sha256(pdf_bytes).hexdigest()
+        pages = self.load_cached_pages(content_hash)
+        if pages is not None:
+            print("PDF text restored from the cache.")
+            yield from pages
+            return
+
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+        num_pages = len(pdf_reader.pages)
+        page_ranges = [(first, min(first + self.PAGES_PER_TASK, num_pages)) for first in range(0, num_pages, self.PAGES_PER_TASK)]
+        pages = []
+        if self.workers <= 1 or len(page_ranges) <= 1 or num_pages < config.pdf_parallel_min_pages:
+            for first, last in page_ranges:
+                range_pages = extract_pages(pdf_reader, first, last)
+                pages.extend(range_pages)
+                yield from range_pages
+        else:
+            # The workers read the PDF from a file, so it is not pickled with every page range
+            with tempfile.TemporaryDirectory() as temp_dir:
+                pdf_path = os.path.join(temp_dir, f"{content_hash}.pdf")
+                with open(pdf_path, 'wb') as file:
+                    file.write(pdf_bytes)
+                executor = self.get_pool(self.workers)
+                futures = [executor.submit(extract_pdf_file_pages, pdf_path, content_hash, first, last) for first, last in page_ranges]
+                for future in futures:
+                    range_pages = future.result()
+                    pages.extend(range_pages)
+                    yield from range_pages
+
+        self.store_cached_pages(content_hash, pages)
+
+    def iter_paper_element(self, pdf_bytes):
+        # The pages are separated by a space, like the text of the whole paper used to be joined
+        yield '<paper>\n'
+        for index, page in enumerate(self.iter_pdf_pages(pdf_bytes)):
+            yield (' ' if index else '') + escape_xml(page)
+        yield '\n</paper>\n'
 
-        return formatted_text
+    def process_pdf(self, url):
+        return ' '.join(self.iter_pdf_pages(self.download_pdf(url)))
 
-    def process_doi_or_pmid(self, identifier):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36',
-            'Connection': 'keep-alive'
-        }
+    def iter_arxiv_pdf(self, arxiv_abs_url):
+        pdf_url = arxiv_abs_url.replace("/abs/", "/pdf/") + ".pdf"
+        pdf_bytes = self.download_pdf(pdf_url)
 
-        try:
-            payload = {
-                'sci-hub-plugin-check': '',
-                'request': identifier
-            }
+        yield f'<source type="arxiv_paper" url="{arxiv_abs_url}">\n'
+        yield from self.iter_paper_element(pdf_bytes)
+        yield '</source>'
+        print("ArXiv paper processed successfully.")
 
-            base_url = 'https://sci-hub.se/'
-            response = requests.post(base_url, headers=headers, data=payload, timeout=60)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            pdf_element = soup.find(id='pdf')
+    def process_arxiv_pdf(self, arxiv_abs_url):
+        return ''.join(self.iter_arxiv_pdf(arxiv_abs_url))
 
-            if pdf_element is None:
-                raise ValueError(f"No PDF found for identifier {identifier}. Sci-hub might be inaccessible or the document is not available.")
+    def write_arxiv_pdf(self, arxiv_abs_url, output_file):
+        write_fragments(self.iter_arxiv_pdf(arxiv_abs_url), output_file)
 
-            content = pdf_element.get('src').replace('#navpanes=0&view=FitH', '').replace('//', '/')
+    def get_sci_hub_pdf_url(self, identifier):
+        payload = {
+            'sci-hub-plugin-check': '',
+            'request': identifier
+        }
 
-            if content.startswith(('/downloads', '/tree', '/uptodate')):
-                pdf_url = 'https://sci-hub.se' + content
-            else:
-                pdf_url = 'https:/' + content
+        base_url = 'https://sci-hub.se/'
+        response = requests.post(base_url, headers=self.HEADERS, data=payload, timeout=60)
+        soup = BeautifulSoup(response.content, 'html.parser')
+        pdf_element = soup.find(id='pdf')
 
-            pdf_filename = f"{identifier.replace('/', '-')}.pdf"
-            wget.download(pdf_url, pdf_filename)
+        if pdf_element is None:
+            raise ValueError(f"No PDF found for identifier {identifier}. Sci-hub might be inaccessible or the document is not available.")
 
-            with open(pdf_filename, 'rb') as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                text = ""
-                for page in range(len(pdf_reader.pages)):
-                    text += pdf_reader.pages[page].extract_text()
+        content = pdf_element.get('src').replace('#navpanes=0&view=FitH', '').replace('//', '/')
 
-            formatted_text = f'<source type="sci_hub_paper" identifier="{escape_xml(identifier)}">\n'
-            formatted_text += self.add_xml_tags_for_paper(text)
-            formatted_text += '</source>'
+        if content.startswith(('/downloads', '/tree', '/uptodate')):
+            return 'https://sci-hub.se' + content
+        return 'https:/' + content
 
-            os.remove(pdf_filename)
-            print(f"Identifier {identifier} processed successfully.")
-            return formatted_text
-        
+    def iter_doi_or_pmid(self, identifier):
+        try:
+            pdf_bytes = self.download_pdf(self.get_sci_hub_pdf_url(identifier), headers=self.HEADERS)
         except (requests.RequestException, ValueError) as e:
-            error_text = f'<source type="sci_hub_paper" identifier="{escape_xml(identifier)}">\n'
-            error_text += f'<error>{escape_xml(str(e))}</error>\n'
-            error_text += '</source>'
+            yield f'<source type="sci_hub_paper" identifier="{escape_xml(identifier)}">\n'
+            yield f'<error>{escape_xml(str(e))}</error>\n'
+            yield '</source>'
             print(f"Error processing identifier {identifier}: {str(e)}")
             print("Sci-hub appears to be inaccessible or the document was not found. Please try again later.")
-            return error_text
+            return
+
+        yield f'<source type="sci_hub_paper" identifier="{escape_xml(identifier)}">\n'
+        yield from self.iter_paper_element(pdf_bytes)
+        yield '</source>'
+        print(f"Identifier {identifier} processed successfully.")
+
+    def process_doi_or_pmid(self, identifier):
+        return ''.join(self.iter_doi_or_pmid(identifier))
+
+    def write_doi_or_pmid(self, identifier, output_file):
+        write_fragments(self.iter_doi_or_pmid(identifier), output_file)
 
 class FolderMethods():
-    def __init__(self, filepath):
+    def __init__(self, filepath, workers=None, file_filter=None):
         self.filepath = filepath
-
-    def process_local_directory(self):
-        content = [f'<source type="local_directory" path="{escape_xml(self.filepath)}">']
+        # Number of threads reading and converting files, 1 reads the files one by one
+        self.workers = workers or config.folder_read_workers
+        self.file_filter = file_filter or FileFilter()
+
+    def read_local_file(self, file_path):
+        # Returns None for files that are too large or binary
+        with open(file_path, "rb") as f:
+            content = f.read(self.file_filter.max_file_size + 1)
+        if not self.file_filter.include_content(content):
+            print(f"Skipping {file_path} (binary or larger than {self.file_filter.max_file_size} bytes)")
+            return None
+        if file_path.endswith(".ipynb"):
+            try:
+                return escape_xml(process_ipynb_text(decode_file_content(content)))
+            except Exception as e:
+                # A malformed notebook only skips its own file
+                print(f"Skipping {file_path} (notebook could not be converted: {e})")
+                return None
+        return escape_xml(decode_file_content(content))
+
+    def iter_allowed_files(self):
+        # Ignored folders are removed from dirnames, so os.walk does not descend into them
         for dirpath, dirnames, filenames in os.walk(self.filepath):
+            relative_dir = os.path.relpath(dirpath, self.filepath).replace(os.sep, '/')
+            relative_dir = '' if relative_dir == '.' else relative_dir + '/'
+            if '.gitignore' in filenames:
+                self.file_filter.add_gitignore(os.path.join(dirpath, '.gitignore'), relative_dir)
+            dirnames[:] = [dirname for dirname in dirnames if self.file_filter.include_directory(relative_dir + dirname)]
             for file in filenames:
-                if is_allowed_filetype(file):
-                    print(f"Processing {os.path.join(dirpath, file)}...")
+                if not self.file_filter.include_file(relative_dir + file):
+                    continue
+                # Only the included files are stat'ed, those over max_file_size are left out without opening them
+                file_path = os.path.join(dirpath, file)
+                try:
+                    size = os.stat(file_path).st_size
+                except OSError:
+                    # Broken symbolic link or file removed during the walk
+                    continue
+                if size <= self.file_filter.max_file_size:
+                    yield file_path
+
+    def iter_file_contents(self):
+        """
+        Yields (file_path, escaped content) for every included file, in os.walk order (see FileFilter).
+        Files that turn out to be binary or too large when they are read are left out.
 
-                    file_path = os.path.join(dirpath, file)
-                    relative_path = os.path.relpath(file_path, self.filepath)
-                    content.append(f'<file name="{escape_xml(relative_path)}">')
+        With more than one worker, the files are read (and notebooks converted) by a thread pool.
+        At most four files per worker are read ahead, so memory stays bounded.
+        """
+        if self.workers <= 1:
+            for file_path in self.iter_allowed_files():
+                print(f"Processing {file_path}...")
+                content = self.read_local_file(file_path)
+                if content is not None:
+                    yield file_path, content
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for file_path in self.iter_allowed_files():
+                print(f"Processing {file_path}...")
+                pending.append((file_path, executor.submit(self.read_local_file, file_path)))
+                if len(pending) >= 4 * self.workers:
+                    file_path, future = pending.popleft()
+                    content = future.result()
+                    if content is not None:
+                        yield file_path, content
+            while pending:
+                file_path, future = pending.popleft()
+                content = future.result()
+                if content is not None:
+                    yield file_path, content
+
+    def iter_local_directory(self):
+        """
+        Yields the flattened directory as XML fragments (<source>, <file> elements and file contents).
 
-                    if file.endswith(".ipynb"):
-                        content.append(escape_xml(process_ipynb_file(file_path)))
-                    else:
-                        with open(file_path, "r", encoding='utf-8', errors='ignore') as f:
-                            content.append(escape_xml(f.read()))
+        Joining the fragments with new-lines gives the full <source> element, so the directory
+        can be written to a file without keeping all file contents in memory.
+        """
+        yield f'<source type="local_directory" path="{escape_xml(self.filepath)}">'
+        for file_path, content in self.iter_file_contents():
+            relative_path = os.path.relpath(file_path, self.filepath)
+            yield f'<file name="{escape_xml(relative_path)}">'
+            yield content
+            yield '</file>'
+
+        yield '</source>'
 
-                    content.append('</file>')
+    def process_local_directory(self):
+        return '\n'.join(self.iter_local_directory())
 
-        content.append('</source>')
-        return '\n'.join(content)
+    def write_local_directory(self, output_file):
+        # Stream the fragments to the output file as the directory is walked
+        with open(output_file, "w", encoding="utf-8") as file:
+            for index, fragment in enumerate(self.iter_local_directory()):
+                if index:
+                    file.write('\n')
+                file.write(fragment)
 
     def process_local_folder(self):
 
         formatted_content = self.process_local_directory()
         print("All files processed.")
         return formatted_content
+
+    def write_local_folder(self, output_file):
+        self.write_local_directory(output_file)
+        print("All files processed.")
     
     def process_directory(self, url, output):
         headers = GitMethods.get_github_token()
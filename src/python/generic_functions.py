@@ -8,11 +8,16 @@ from nbformat import reads
 from nltk.corpus import stopwords
 from nltk import download
 from urllib.parse import urlparse
+from functools import lru_cache
 
 
+ALLOWED_EXTENSIONS = ['.py', '.txt', '.js', '.tsx', '.ts', '.md', '.cjs', '.html', '.json', '.ipynb', '.h', '.localhost', '.sh', '.yaml', '.example', '.ps1', '.sql']
+# Set of the extensions, looked up with the part of a file name from its last dot
+ALLOWED_SUFFIXES = frozenset(ALLOWED_EXTENSIONS)
+
 def is_allowed_filetype(filename):
-    allowed_extensions = ['.py', '.txt', '.js', '.tsx', '.ts', '.md', '.cjs', '.html', '.json', '.ipynb', '.h', '.localhost', '.sh', '.yaml', '.example', '.ps1', '.sql']
-    return any(filename.endswith(ext) for ext in allowed_extensions)
+    dot = filename.rfind('.')
+    return dot >= 0 and filename[dot:] in ALLOWED_SUFFIXES
     
 
 def download_file(url, target_path, headers):
@@ -34,6 +39,17 @@ def escape_xml(text):
     )
 
 
+def decode_file_content(content):
+    """
+    Decodes downloaded file content the same way files are read from disk in text mode.
+
+    Args:
+    content (bytes): Raw file content.
+    """
+    text = content.decode('utf-8', errors='ignore')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
 def process_ipynb_file(temp_file):
     """
     Processes an IPyNB file.
@@ -44,6 +60,16 @@ def process_ipynb_file(temp_file):
     with open(temp_file, "r", encoding='utf-8', errors='ignore') as f:
         notebook_content = f.read()
 
+    return process_ipynb_text(notebook_content)
+
+
+def process_ipynb_text(notebook_content):
+    """
+    Converts the JSON content of an IPyNB file to Python code.
+
+    Args:
+    notebook_content (str): Content of the notebook.
+    """
     exporter = PythonExporter()
     python_code, _ = exporter.from_notebook_node(reads(notebook_content, as_version=4))
     return python_code
@@ -83,7 +109,9 @@ def extract_links(input_file, output_file):
         for url in urls:
             output.write(url + '\n')
 
+@lru_cache(maxsize=None)
 def get_stopword_list():
+    # Downloaded and loaded once per process, the set is shared by all callers
     download("stopwords", quiet=True)
     stop_words = set(stopwords.words("english"))
     return stop_words
\ No newline at end of file
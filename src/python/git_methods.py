@@ -1,14 +1,24 @@
-import requests
 import os
 import re
 
 from dotenv import load_dotenv
-from generic_functions import is_allowed_filetype, escape_xml, process_ipynb_file, download_file
+from generic_functions import ALLOWED_EXTENSIONS, escape_xml, process_ipynb_text, decode_file_content
+from file_filter import FileFilter
+from github_fetcher import GitHubFetcher
+from pull_request_diff import iter_diff_and_comments
+from local_git import LocalGitRepository
+from snapshot_cache import SnapshotCache, ETagStore
+from config import config
 
 class GitMethods():
     def __init__(self, url):
         self.url = url
         self.headers = self.get_github_token()
+        self.etag_store = ETagStore(os.path.join(config.snapshot_cache_path, 'etags.json'))
+        self.fetcher = GitHubFetcher(headers=self.headers, api_base_url=config.github_api_base_url, max_workers=config.github_fetch_workers, etag_store=self.etag_store)
+        # Commit SHA the repository is flattened at, set once the ref is resolved by get_snapshot_key
+        self.commit_sha = None
+        self.file_filter = FileFilter()
 
 
     @staticmethod
@@ -29,8 +39,25 @@ class GitMethods():
 
         return xml_formatted_repository
 
+    @staticmethod
+    def is_local_repository(location):
+        """
+        Checks if the location is a local git repository that should be read from its object store.
+
+        That is the case for file:// URLs, bare repositories and working clones followed by #<ref>.
+        Working clones without a ref are flattened as a regular local folder.
+        """
+        if location.startswith("file://"):
+            return True
+        path, ref = LocalGitRepository.parse_location(location)
+        if not os.path.isdir(path) or not LocalGitRepository.is_git_repository(path):
+            return False
+        return ref is not None or not os.path.exists(os.path.join(path, ".git"))
+
     def handle_git_url(self):
-        if "/pull/" in self.url:
+        if self.is_local_repository(self.url):
+            final_output = self.process_local_git_repo()
+        elif "/pull/" in self.url:
             final_output = self.process_github_pull_request()
         elif "/issues/" in self.url:
             final_output = self.process_github_issue()
@@ -39,41 +66,53 @@ class GitMethods():
 
         return final_output
     
-    def process_git_directory(self, url, repo_content):
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        files = response.json()
-
-        for file in files:
-            if file["type"] == "file" and is_allowed_filetype(file["name"]):
-                print(f"Processing {file['path']}...")
-
-                temp_file = f"temp_{file['name']}"
-                download_file(file["download_url"], temp_file, self.headers)
-
-                repo_content.append(f'<file name="{escape_xml(file["path"])}">') 
-                if file["name"].endswith(".ipynb"):
-                    repo_content.append(escape_xml(process_ipynb_file(temp_file)))
-                else:
-                    with open(temp_file, "r", encoding='utf-8', errors='ignore') as f:
-                        repo_content.append(escape_xml(f.read()))
-                repo_content.append('</file>')
-                os.remove(temp_file)
+    def append_file_element(self, repo_content, path, content):
+        if not self.file_filter.include_content(content):
+            print(f"Skipping {path} (binary or larger than {self.file_filter.max_file_size} bytes)")
+            return
+        file_content = decode_file_content(content)
+        if path.endswith(".ipynb"):
+            try:
+                file_content = process_ipynb_text(file_content)
+            except Exception as e:
+                # A malformed notebook only skips its own file
+                print(f"Skipping {path} (notebook could not be converted: {e})")
+                return
+        repo_content.append(f'<file name="{escape_xml(path)}">')
+        repo_content.append(escape_xml(file_content))
+        repo_content.append('</file>')
+
+    def process_git_tree(self, repo_name, ref, subdirectory, repo_content):
+        # List the whole repository with one Trees API call, then download the included files concurrently
+        if subdirectory:
+            subdirectory = subdirectory.rstrip("/") + "/"
+        entries = [
+            entry for entry in self.fetcher.list_tree(repo_name, ref)
+            if entry["path"].startswith(subdirectory) and self.file_filter.include_path(entry["path"], entry.get("size"))
+        ]
+
+        for entry, content in self.fetcher.iter_blobs(repo_name, entries):
+            print(f"Processing {entry['path']}...")
+            self.append_file_element(repo_content, entry["path"], content)
+
+    def process_local_git_repo(self):
+        # Stream the files of a local repository out of git's object store, without any HTTP calls
+        path, ref = LocalGitRepository.parse_location(self.url)
+        repository = LocalGitRepository(path, self.commit_sha or ref)
+        files = [(file_path, sha) for file_path, sha, size in repository.list_files() if self.file_filter.include_path(file_path, size)]
+
+        repo_content = [f'<source type="github_repository" url="{escape_xml(self.url)}">']
+        for file_path, content in repository.iter_blobs(files):
+            print(f"Processing {file_path}...")
+            self.append_file_element(repo_content, file_path, content)
+        repo_content.append('</source>')
+        print("All files processed.")
 
-            elif file["type"] == "dir":
-                self.process_git_directory(file["url"], repo_content)
-            else:
-                print(f"Skipped {file}")
+        return "\n".join(repo_content)
 
 
-    def process_github_repo(self, base_url=None):
-        # Only possible for public repositories
-        # Pull repository locally and use local path if private
-        if not base_url:
-            base_url = self.url
-
-        print(base_url)
-        api_base_url = "https://api.github.com/repos"
+    @staticmethod
+    def parse_repo_url(base_url):
         repo_url_parts = base_url.split("https://github.com/")[-1].split("/")
         repo_name = "/".join(repo_url_parts[:2])
 
@@ -87,18 +126,59 @@ class GitMethods():
             # Any remaining parts after the branch/tag name form the subdirectory
             if len(repo_url_parts) > 4:
                 subdirectory = "/".join(repo_url_parts[4:])
-        
-        contents_url = f"{api_base_url}/{repo_name}/contents"
-        if subdirectory:
-            contents_url = f"{contents_url}/{subdirectory}"
-        if branch_or_tag:
-            contents_url = f"{contents_url}?ref={branch_or_tag}"
+
+        return repo_name, branch_or_tag, subdirectory
+
+    def get_snapshot_key(self):
+        """
+        Resolves the commit the repository URL points to and builds the snapshot cache key for it.
+
+        Returns (str): The key, or None for pull requests and issues, which are never cached.
+        """
+        filter_settings = {
+            'url': self.url,
+            'allowed_extensions': ALLOWED_EXTENSIONS,
+            'ignore_patterns': self.file_filter.patterns,
+            'max_file_size': self.file_filter.max_file_size,
+        }
+
+        if self.is_local_repository(self.url):
+            path, ref = LocalGitRepository.parse_location(self.url)
+            self.commit_sha = LocalGitRepository(path, ref).resolve_commit()
+            return SnapshotCache.make_key('local', os.path.abspath(path), self.commit_sha, filter_settings)
+
+        if "/pull/" in self.url or "/issues/" in self.url:
+            return None
+
+        repo_name, branch_or_tag, subdirectory = self.parse_repo_url(self.url)
+        if not branch_or_tag:
+            branch_or_tag = self.fetcher.get_default_branch(repo_name)
+        self.commit_sha = self.fetcher.resolve_commit(repo_name, branch_or_tag)
+        self.etag_store.save()
+
+        owner, repo = repo_name.split("/")
+        filter_settings['subdirectory'] = subdirectory
+        return SnapshotCache.make_key(owner, repo, self.commit_sha, filter_settings)
+
+    def process_github_repo(self, base_url=None):
+        # Only possible for public repositories
+        # Pull repository locally and use local path if private
+        if not base_url:
+            base_url = self.url
+
+        print(base_url)
+        repo_name, branch_or_tag, subdirectory = self.parse_repo_url(base_url)
+
+        if base_url == self.url and self.commit_sha:
+            branch_or_tag = self.commit_sha
+        elif not branch_or_tag:
+            branch_or_tag = self.fetcher.get_default_branch(repo_name)
 
         # Configure a variable with a XML-like structure
         # This variable will be exported as a .txt file
         repo_content = [f'<source type="github_repository" url="{base_url}">']
 
-        self.process_git_directory(contents_url, repo_content)
+        self.process_git_tree(repo_name, branch_or_tag, subdirectory, repo_content)
         repo_content.append('</source>')
         print("All files processed.")
 
@@ -110,81 +190,48 @@ class GitMethods():
         repo_owner = url_parts[3]
         repo_name = url_parts[4]
         pull_request_number = url_parts[-1]
-        api_base_url = "https://api.github.com/repos"
+        repo_api_url = f"{self.fetcher.api_base_url}/repos/{repo_owner}/{repo_name}"
 
-        pull_request_url = f"{api_base_url}/{repo_owner}/{repo_name}/pulls/{pull_request_number}"
+        pull_request_url = f"{repo_api_url}/pulls/{pull_request_number}"
         
     #region PR: Get changes and comments
-        # 1. Get all metadata related to the PR
-        response = requests.get(pull_request_url, headers=self.headers)
-        pull_request_data = response.json()
-
-        # 2. Get all changes made to the repository
-        diff_url = pull_request_data["diff_url"]
-        diff_response = requests.get(diff_url, headers=self.headers)
-        pull_request_diff = diff_response.text
-
-        # 3. Get all PR-level comments (general comments left on the submitted PR)
-        comments_url = pull_request_data["comments_url"]
-        comments_response = requests.get(comments_url, headers=self.headers)
-        comments_data = comments_response.json()
-
-        # 4. Get all code-level comments (comments on the changed files)
-        review_comments_url = pull_request_data["review_comments_url"]
-        review_comments_response = requests.get(review_comments_url, headers=self.headers)
-        review_comments_data = review_comments_response.json()
-
-        # 5. Sort the comments on their position
-        all_comments = comments_data + review_comments_data
-        all_comments.sort(key=lambda comment: comment.get("position") or float("inf"))
+        # The calls only depend on the PR number and run at the same time, the comment lists with all their pages
+        pull_request_data, pull_request_diff, comments_data, review_comments_data = self.fetcher.run_concurrently(
+            # 1. Get all metadata related to the PR
+            lambda: self.fetcher.get_json(pull_request_url),
+            # 2. Get all changes made to the repository
+            lambda: self.fetcher.get(pull_request_url, headers={"Accept": "application/vnd.github.diff"}).text,
+            # 3. Get all PR-level comments (general comments left on the submitted PR)
+            lambda: self.fetcher.get_all_pages(f"{repo_api_url}/issues/{pull_request_number}/comments"),
+            # 4. Get all code-level comments (comments on the changed files)
+            lambda: self.fetcher.get_all_pages(f"{pull_request_url}/comments"),
+        )
     #endregion
 
 
     #region PR: Add XML elements
         # Add opening element: pull_request_info
-        formatted_text = f'<source type="github_pull_request" url="{self.url}">\n'
-        formatted_text += '<pull_request_info>\n'
+        parts = [f'<source type="github_pull_request" url="{self.url}">\n', '<pull_request_info>\n']
 
         # Add generic elements: title, description, merge_details
-        formatted_text += f'<title>{escape_xml(pull_request_data["title"])}</title>\n'
-        formatted_text += f'<description>{escape_xml(pull_request_data["body"])}</description>\n'
-        formatted_text += '<merge_details>\n'
-        formatted_text += f'{escape_xml(pull_request_data["user"]["login"])} wants to merge {pull_request_data["commits"]} commit into {repo_owner}:{pull_request_data["base"]["ref"]} from {pull_request_data["head"]["label"]}\n'
-        formatted_text += '</merge_details>\n'
+        parts.append(f'<title>{escape_xml(pull_request_data["title"])}</title>\n')
+        parts.append(f'<description>{escape_xml(pull_request_data["body"])}</description>\n')
+        parts.append('<merge_details>\n')
+        parts.append(f'{escape_xml(pull_request_data["user"]["login"])} wants to merge {pull_request_data["commits"]} commit into {repo_owner}:{pull_request_data["base"]["ref"]} from {pull_request_data["head"]["label"]}\n')
+        parts.append('</merge_details>\n')
 
-        # Iteratively add PR changes and comments left on PR as text fields
+        # Add PR changes with the review comments below the lines they were left on, then the PR-level comments
         # Parent element: diff_and_comments
-        formatted_text += '<diff_and_comments>\n'
-        diff_lines = pull_request_diff.split("\n")
-        comment_index = 0
-
-        for line in diff_lines:
-            formatted_text += f'{escape_xml(line)}\n'
-            while comment_index < len(all_comments) and all_comments[comment_index].get("position") == diff_lines.index(line):
-                comment = all_comments[comment_index]
-                # Comment element
-                """
-                <review_comment>
-                    <author>xxx</author>
-                    <content>xxx</content>
-                    <path>xxx</path>
-                    <line>xxx</line>
-                </review_comment>
-                """
-                formatted_text += f'<review_comment>\n'
-                formatted_text += f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
-                formatted_text += f'<content>{escape_xml(comment["body"])}</content>\n'
-                formatted_text += f'<path>{escape_xml(comment["path"])}</path>\n'
-                formatted_text += f'<line>{comment["original_line"]}</line>\n'
-                formatted_text += '</review_comment>\n'
-                comment_index += 1
+        parts.append('<diff_and_comments>\n')
+        parts.extend(iter_diff_and_comments(pull_request_diff, review_comments_data + comments_data))
 
         # Close open elements
-        formatted_text += '</diff_and_comments>\n'
-        formatted_text += '</pull_request_info>\n'
+        parts.append('</diff_and_comments>\n')
+        parts.append('</pull_request_info>\n')
 
         # Regular processing of the repo
-        formatted_text += self.process_github_main_branch(repo_owner, repo_name)
+        parts.append(self.process_github_main_branch(repo_owner, repo_name))
+        formatted_text = ''.join(parts)
     #endregion
 
         print(f"Pull request {pull_request_number} and repository content processed successfully.")
@@ -192,38 +239,42 @@ class GitMethods():
         
 
     def process_github_issue(self):
-        url_parts = self.issue_url.split("/")
+        url_parts = self.url.split("/")
         repo_owner = url_parts[3]
         repo_name = url_parts[4]
         issue_number = url_parts[-1]
-        api_base_url = "https://api.github.com/repos"
 
-        issue_url = f"{api_base_url}/{repo_owner}/{repo_name}/issues/{issue_number}"
+        issue_url = f"{self.fetcher.api_base_url}/repos/{repo_owner}/{repo_name}/issues/{issue_number}"
     
     #region ISSUE: Get metadata
-        response = requests.get(issue_url, headers=self.headers)
-        issue_data = response.json()
-
-        comments_url = issue_data["comments_url"]
-        comments_response = requests.get(comments_url, headers=self.headers)
-        comments_data = comments_response.json()
+        issue_data, comments_data = self.fetcher.run_concurrently(
+            lambda: self.fetcher.get_json(issue_url),
+            lambda: self.fetcher.get_all_pages(f"{issue_url}/comments"),
+        )
+
+        # Extract code snippets from comments on a GitHub issue
+        # Regex: Find all URLs in the comment bodies that match the pattern for GitHub file links with line ranges
+        snippets_per_comment = [re.findall(r'(https://github\.com/[^\s)#]+)#L(\d+)-L(\d+)', comment["body"] or "") for comment in comments_data]
+        # Use the FILE URL to get the raw contents of every referenced file, once per file
+        file_contents = self.fetcher.fetch_files(
+            file_url.replace("/blob/", "/raw/") for snippets in snippets_per_comment for file_url, _, _ in snippets
+        )
     #endregion
 
 
     #region ISSUE: Add XML elements
         # Add opening element: issue_info
-        formatted_text = f'<source type="github_issue" url="{self.issue_url}">\n'
-        formatted_text += '<issue_info>\n'
+        parts = [f'<source type="github_issue" url="{self.url}">\n', '<issue_info>\n']
 
         # Add generic elements: title, description
-        formatted_text += f'<title>{escape_xml(issue_data["title"])}</title>\n'
-        formatted_text += f'<description>{escape_xml(issue_data["body"])}</description>\n'
+        parts.append(f'<title>{escape_xml(issue_data["title"])}</title>\n')
+        parts.append(f'<description>{escape_xml(issue_data["body"])}</description>\n')
         
         # Iteratively add comments left on PR as text fields
         # Parent element: comments
-        formatted_text += '<comments>\n'
+        parts.append('<comments>\n')
 
-        for comment in comments_data:
+        for comment, snippets in zip(comments_data, snippets_per_comment):
             # Comment element
             """
             <comment>
@@ -233,45 +284,33 @@ class GitMethods():
                 </content>
             </comment>
             """
-            formatted_text += '<comment>\n'
-            formatted_text += f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
-            formatted_text += f'<content>{escape_xml(comment["body"])}</content>\n'
-
-            # Extract code snippets from comments on a GitHub issue
-            # Regex: Find all occurrences of URLs in the comment body that match the pattern for GitHub file links with line ranges
-            code_snippets = re.findall(r'https://github.com/.*#L\d+-L\d+', comment['body'])
-            for snippet_url in code_snippets:
-                # Split URL into two parts: the base URL and the line range.
-                url_parts = snippet_url.split("#")
-
-                # Use the FILE URL to get the raw contents of the file
-                try:
-                    file_url = url_parts[0].replace("/blob/", "/raw/")
-                    file_response = requests.get(file_url, headers=self.headers)
-                    file_content = file_response.text
-
-                    # Using the file content, get the relevant code snippets back using the start and end indices
-                    line_range = url_parts[1]
-                    start_line, end_line = map(int, line_range.split("-")[0][1:]), map(int, line_range.split("-")[1][1:])
-                    code_lines = file_content.split("\n")[start_line-1:end_line]
-                    code_snippet = "\n".join(code_lines)
-
-                    # Format the final code snippet using XML
-                    formatted_text += '<code_snippet>\n'
-                    formatted_text += f'<![CDATA[{code_snippet}]]>\n'
-                    formatted_text += '</code_snippet>\n'
-                except requests.exceptions.RequestException as e:
-                    Warning(f"Error fetching file: {e}")
-                    continue  # Skip to the next snippet if there's an error
-
-            formatted_text += '</comment>\n'
+            parts.append('<comment>\n')
+            parts.append(f'<author>{escape_xml(comment["user"]["login"])}</author>\n')
+            parts.append(f'<content>{escape_xml(comment["body"])}</content>\n')
+
+            for file_url, start_line, end_line in snippets:
+                file_content = file_contents[file_url.replace("/blob/", "/raw/")]
+                if file_content is None:
+                    continue  # Skip the snippets of files that could not be fetched
+
+                # Using the file content, get the relevant code snippets back using the start and end indices
+                code_lines = file_content.split("\n")[int(start_line)-1:int(end_line)]
+                code_snippet = "\n".join(code_lines)
+
+                # Format the final code snippet using XML
+                parts.append('<code_snippet>\n')
+                parts.append(f'<![CDATA[{code_snippet}]]>\n')
+                parts.append('</code_snippet>\n')
+
+            parts.append('</comment>\n')
 
         # Close open elements
-        formatted_text += '</comments>\n'
-        formatted_text += '</issue_info>\n'
+        parts.append('</comments>\n')
+        parts.append('</issue_info>\n')
 
         # Regular processing of the repo
-        formatted_text += self.process_github_main_branch(repo_owner, repo_name)
+        parts.append(self.process_github_main_branch(repo_owner, repo_name))
+        formatted_text = ''.join(parts)
     #endregion
 
         print(f"Issue {issue_number} and repository content processed successfully.")
@@ -0,0 +1,220 @@
+import re
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class GitHubFetcher():
+    """
+    Fetches repository trees, file contents and pull request or issue comments from the GitHub REST API.
+
+    All calls go over one pooled requests.Session and at most max_workers downloads run at the same time.
+    The X-RateLimit-* headers of every response are tracked: once the remaining budget runs low the
+    requests are spread out until the reset time, and when it is exhausted all workers wait for the reset.
+    """
+    def __init__(self, headers=None, api_base_url="https://api.github.com", max_workers=8, max_retries=5, etag_store=None):
+        self.api_base_url = api_base_url.rstrip("/")
+        self.etag_store = etag_store
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._rate_limit_lock = threading.Lock()
+        self._next_request_time = 0.0
+
+    def _wait_for_rate_limit(self):
+        with self._rate_limit_lock:
+            delay = self._next_request_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _update_rate_limit(self, response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        retry_after = response.headers.get("Retry-After")
+
+        next_request_time = 0.0
+        if retry_after is not None:
+            next_request_time = time.time() + float(retry_after)
+        elif remaining is not None and reset is not None:
+            remaining, reset = int(remaining), float(reset)
+            if remaining == 0:
+                next_request_time = reset
+            elif remaining < 2 * self.max_workers:
+                # Spread the last requests over the time left in the rate limit window
+                next_request_time = time.time() + max(0.0, reset - time.time()) / remaining
+
+        with self._rate_limit_lock:
+            self._next_request_time = max(self._next_request_time, next_request_time)
+
+    def get(self, url, **kwargs):
+        for attempt in range(self.max_retries):
+            self._wait_for_rate_limit()
+            response = self.session.get(url, **kwargs)
+            self._update_rate_limit(response)
+
+            rate_limited = response.status_code == 429 or (response.status_code == 403 and response.headers.get("X-RateLimit-Remaining") == "0")
+            if not rate_limited:
+                break
+            print(f"Rate limited by GitHub, retrying {url} (attempt {attempt + 1}/{self.max_retries})...")
+
+        response.raise_for_status()
+        return response
+
+    def get_json(self, url, **kwargs):
+        return self.get(url, **kwargs).json()
+
+    def get_conditional(self, url, headers=None):
+        """
+        Gets the body of a metadata call, revalidating the previous answer with If-None-Match when an ETag store is set.
+        """
+        headers = dict(headers or {})
+        store_key = f"{url} {headers.get('Accept', '')}"
+        cached = self.etag_store.get(store_key) if self.etag_store is not None else None
+        if cached:
+            headers["If-None-Match"] = cached["etag"]
+
+        response = self.get(url, headers=headers)
+        if response.status_code == 304:
+            return cached["body"]
+        if self.etag_store is not None and response.headers.get("ETag"):
+            self.etag_store.put(store_key, response.headers["ETag"], response.text)
+        return response.text
+
+    def get_all_pages(self, url, params=None):
+        """
+        Gets all items of a paginated list call (comments, review comments...), 100 per page.
+
+        The first page gives the number of pages in its Link header, the other pages are then fetched
+        concurrently. Lists whose Link header has no last page are followed page by page.
+
+        Returns (list): The items of all pages, in order.
+        """
+        params = dict(params or {}, per_page=100)
+        response = self.get(url, params=params)
+        items = response.json()
+
+        last_url = response.links.get("last", {}).get("url")
+        last_page = re.search(r'[?&]page=(\d+)', last_url or "")
+        if last_page:
+            pages = range(2, int(last_page.group(1)) + 1)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for page_items in executor.map(lambda page: self.get_json(url, params=dict(params, page=page)), pages):
+                    items.extend(page_items)
+            return items
+
+        while "next" in response.links:
+            response = self.get(response.links["next"]["url"])
+            items.extend(response.json())
+        return items
+
+    def run_concurrently(self, *calls):
+        """
+        Runs independent calls (functions without arguments) at the same time, over the pooled session.
+
+        Returns (list): The results of the calls, in order. The first error is raised once all calls finished.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    def fetch_files(self, urls):
+        """
+        Downloads files (e.g. raw files on github.com) concurrently, each distinct URL once.
+
+        Returns (dict): URL to the text of the file, or None if it could not be downloaded.
+        """
+        def fetch_file(url):
+            try:
+                return self.get(url).text
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching file {url}: {e}")
+                return None
+
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(urls, executor.map(fetch_file, urls)))
+
+    def get_default_branch(self, repo_name):
+        return json.loads(self.get_conditional(f"{self.api_base_url}/repos/{repo_name}"))["default_branch"]
+
+    def resolve_commit(self, repo_name, ref):
+        # The sha media type returns only the commit SHA the ref points to
+        url = f"{self.api_base_url}/repos/{repo_name}/commits/{ref}"
+        return self.get_conditional(url, headers={"Accept": "application/vnd.github.sha"}).strip()
+
+    def list_tree(self, repo_name, ref):
+        """
+        Lists all files of the repository at the given ref with one recursive Trees API call.
+        Trees too large for one call (truncated by GitHub) are listed folder by folder instead.
+
+        Returns (list): The blob entries of the tree (path, sha, size...), in the order of the tree.
+        """
+        tree = self.get_json(f"{self.api_base_url}/repos/{repo_name}/git/trees/{ref}", params={"recursive": "1"})
+        if tree.get("truncated"):
+            print(f"The tree of {repo_name} at {ref} is too large for one call, listing it folder by folder...")
+            return self.list_tree_by_folder(repo_name, ref)
+        return [entry for entry in tree["tree"] if entry["type"] == "blob"]
+
+    def list_tree_by_folder(self, repo_name, ref):
+        """
+        Lists all files of the repository at the given ref with one non-recursive Trees API call per folder.
+        The folders of the same depth are listed concurrently.
+
+        Returns (list): The blob entries with their path from the root, in the order of the recursive listing.
+        """
+        def get_entries(sha):
+            tree = self.get_json(f"{self.api_base_url}/repos/{repo_name}/git/trees/{sha}")
+            if tree.get("truncated"):
+                raise RuntimeError(f"The folder {sha} of {repo_name} holds too many entries to be listed by the Trees API.")
+            return tree["tree"]
+
+        trees = {}
+        level = [ref]
+        while level:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                trees.update(zip(level, executor.map(get_entries, level)))
+            level = list(dict.fromkeys(
+                entry["sha"] for sha in level for entry in trees[sha] if entry["type"] == "tree" and entry["sha"] not in trees
+            ))
+
+        def walk(sha, prefix):
+            for entry in trees[sha]:
+                if entry["type"] == "tree":
+                    yield from walk(entry["sha"], f"{prefix}{entry['path']}/")
+                elif entry["type"] == "blob":
+                    yield dict(entry, path=prefix + entry["path"])
+        return list(walk(ref, ""))
+
+    def fetch_blob(self, repo_name, sha):
+        response = self.get(f"{self.api_base_url}/repos/{repo_name}/git/blobs/{sha}", headers={"Accept": "application/vnd.github.raw+json"})
+        return response.content
+
+    def iter_blobs(self, repo_name, entries):
+        """
+        Downloads the blobs of the given tree entries concurrently.
+
+        Yields (tuple): The entry and the raw file content, in the order of entries.
+        At most two downloads per worker are in flight or waiting to be consumed.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for entry in entries:
+                pending.append((entry, executor.submit(self.fetch_blob, repo_name, entry["sha"])))
+                if len(pending) >= 2 * self.max_workers:
+                    entry, future = pending.popleft()
+                    yield entry, future.result()
+            while pending:
+                entry, future = pending.popleft()
+                yield entry, future.result()
@@ -0,0 +1,101 @@
+import os
+import threading
+import subprocess
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+
+class LocalGitRepository():
+    """
+    Reads files straight out of the object store of a local git repository (bare or working clone).
+
+    Files are listed with one `git ls-tree` call and their contents are streamed in bulk
+    through a single long-lived `git cat-file --batch` process, so no working tree checkout is needed.
+    """
+    def __init__(self, path, ref=None):
+        self.path = path
+        self.ref = ref or "HEAD"
+
+    @staticmethod
+    def parse_location(location):
+        """
+        Splits a local repository location into its path and ref.
+
+        Accepts plain paths and file:// URLs, optionally followed by #<ref> (branch, tag or commit).
+        """
+        location, _, ref = location.partition("#")
+        if location.startswith("file://"):
+            location = url2pathname(urlparse(location).path)
+        return location, ref or None
+
+    @staticmethod
+    def is_git_repository(path):
+        # Bare repositories hold HEAD and objects/ directly, working clones have a .git entry
+        is_bare = os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(os.path.join(path, "objects"))
+        return is_bare or os.path.exists(os.path.join(path, ".git"))
+
+    def run_git(self, *args):
+        result = subprocess.run(["git", "-C", self.path, *args], capture_output=True, check=True)
+        return result.stdout
+
+    def resolve_commit(self):
+        return self.run_git("rev-parse", "--verify", f"{self.ref}^{{commit}}").decode().strip()
+
+    def list_files(self, subdirectory=""):
+        """
+        Lists the regular files of the tree at the ref.
+
+        Returns (list): Tuples of (path, blob sha, size in bytes), in git's tree order.
+        """
+        args = ["ls-tree", "-r", "-l", "-z", self.ref]
+        if subdirectory:
+            args += ["--", subdirectory]
+
+        files = []
+        for record in self.run_git(*args).split(b"\0"):
+            if not record:
+                continue
+            metadata, path = record.split(b"\t", 1)
+            # The size column is padded with spaces
+            mode, object_type, sha, size = metadata.split()
+            # Skip submodules and symbolic links
+            if object_type == b"blob" and mode != b"120000":
+                files.append((path.decode("utf-8", errors="replace"), sha.decode(), int(size)))
+        return files
+
+    def iter_blobs(self, files):
+        """
+        Streams the contents of the given files from one `git cat-file --batch` process.
+
+        Yields (tuple): The path and the raw file content, in the order of files.
+        """
+        process = subprocess.Popen(["git", "-C", self.path, "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        # Feed the object ids from a separate thread so the pipes can't block each other
+        def write_object_ids():
+            try:
+                for _, sha in files:
+                    process.stdin.write(f"{sha}\n".encode())
+                process.stdin.close()
+            except BrokenPipeError:
+                # The reader stopped early and git was terminated
+                pass
+
+        writer = threading.Thread(target=write_object_ids, daemon=True)
+        writer.start()
+        completed = False
+        try:
+            for path, sha in files:
+                header = process.stdout.readline().split()
+                if len(header) != 3:
+                    raise RuntimeError(f"git cat-file could not read {path} ({sha}): {b' '.join(header).decode()}")
+                content = process.stdout.read(int(header[2]))
+                process.stdout.read(1)  # Trailing new-line after every object
+                yield path, content
+            completed = True
+        finally:
+            if not completed:
+                process.kill()
+            writer.join()
+            process.stdout.close()
+            process.wait()
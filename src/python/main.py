@@ -8,7 +8,7 @@ from rich.prompt import Prompt
 from rich.console import Console
 # orchestrator.py
 
-def main():
+def main(params):
     # console = Console()
 
     # if len(sys.argv) > 1:
@@ -24,8 +24,10 @@ def main():
     create_text_file.main()
     create_vector_db.main()
 
+    # Load the embedding model, vector database and LLM once for all questions
+    session = prompt_llm.QuerySession()
     while True:
-        prompt_llm.main()
+        prompt_llm.main(session)
 
 if __name__ == "__main__":
     # Example of parsing command-line arguments
@@ -0,0 +1,20 @@
+# Page extraction of PDFFileMethods (file_processing.py). Its worker processes only need this module,
+# so it imports nothing but PyPDF2.
+from PyPDF2 import PdfReader
+
+# Content hash and reader of the PDF this worker process parsed last, reused by the following page ranges of the paper
+_open_pdf = (None, None)
+
+
+def extract_pages(pdf_reader, first_page, last_page):
+    # Text of the pages first_page..last_page - 1
+    return [pdf_reader.pages[page].extract_text() or '' for page in range(first_page, last_page)]
+
+
+def extract_pdf_file_pages(pdf_path, content_hash, first_page, last_page):
+    # Runs in a worker process: the PDF is read from a file instead of being pickled with every task,
+    # and parsed once per worker and paper
+    global _open_pdf
+    if _open_pdf[0] != content_hash:
+        _open_pdf = (content_hash, PdfReader(pdf_path))
+    return extract_pages(_open_pdf[1], first_page, last_page)
@@ -1,10 +1,23 @@
 from langchain_huggingface import HuggingFaceEmbeddings, HuggingFaceEndpoint
 from langchain_community.vectorstores import FAISS
+from langchain_core.outputs import LLMResult, Generation
 
 import os
-import re
-import html
+import sys
+import json
+import time
 import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import faiss
+
+from config import config
+from faiss_index import load_index_params, apply_search_parameters, open_vector_store
+from chunk_store import ChunkStore, CHUNK_STORE_FILE
+from answer_cache import AnswerCache
+from token_counting import get_encoding
+from context_packing import pack_context
 
 # codestral_config = {
 #     'class_name': 'CodeStral',
@@ -29,70 +42,403 @@ import importlib
 def load_llm():
     return HuggingFaceEndpoint(repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1")
 
+def load_vector_store(embeddings, vector_db_path=None):
+    vector_db_path = vector_db_path or config.vector_db_path
+    if os.path.exists(os.path.join(vector_db_path, CHUNK_STORE_FILE)):
+        # The retrieved chunks are read from the chunk store; 'mmap' also maps the index file instead of reading it
+        return open_vector_store(embeddings, vector_db_path, mmap=config.index_load_mode == 'mmap')
+
+    # Vector databases built before the chunk store hold the chunks in a pickle
+    vector_store = FAISS.load_local(vector_db_path, embeddings, allow_dangerous_deserialization=True)
+    apply_search_parameters(vector_store.index, load_index_params(vector_db_path)['index_type'])
+    return vector_store
+
 # Step 2: Query function
-def query_llm(llm, vector_store, user_query):
-    retriever = vector_store.as_retriever()
-    # context = retriever.retrieve(user_query)
-    # Retrieve relevant documents
-    relevant_docs = retriever.invoke(user_query)
+def dense_search(vector_store, user_query, k, search_filter=None, query_vector=None):
+    # search_filter restricts the search on chunk metadata, e.g. {'path': 'src/main.py'} or {'source_type': 'github_repository'}
+    # The filter is applied after the nearest neighbours are fetched, so fetch more candidates when filtering
+    search_kwargs = {'filter': search_filter, 'fetch_k': 1000} if search_filter else {}
+    if query_vector is not None:
+        # The query was already embedded, e.g. for the answer cache
+        return vector_store.similarity_search_by_vector(query_vector, k=k, **search_kwargs)
+    return vector_store.similarity_search(user_query, k=k, **search_kwargs)
+
+def keyword_search(vector_store, user_query, k, search_filter=None):
+    # BM25 search on the keyword index of the chunk store (vector databases with a pickled docstore have none)
+    if not isinstance(vector_store.docstore, ChunkStore):
+        return []
+    return vector_store.docstore.keyword_search(user_query, k, search_filter)
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60):
+    """
+    Merges ranked lists of Documents: every Document scores 1 / (rrf_k + rank) for each list it appears in.
+
+    Returns (list): The k Documents with the highest total score.
+    """
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            scores[doc.id] = scores.get(doc.id, 0) + 1 / (rrf_k + rank)
+            documents.setdefault(doc.id, doc)
+    return [documents[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+def retrieve_documents(vector_store, user_query, search_filter=None, query_vector=None):
+    """
+    Retrieves the config.retrieval_k chunks most relevant to the query.
+
+    With config.hybrid_search, the dense FAISS search and the BM25 keyword search run concurrently
+    and their results are merged with reciprocal-rank fusion, so chunks that name the identifiers
+    of the query are found even when their embedding is not among the nearest neighbours.
+    """
+    if not config.hybrid_search:
+        return dense_search(vector_store, user_query, config.retrieval_k, search_filter, query_vector)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dense_results = executor.submit(dense_search, vector_store, user_query, config.hybrid_candidates, search_filter, query_vector)
+        keyword_results = executor.submit(keyword_search, vector_store, user_query, config.hybrid_candidates, search_filter)
+        result_lists = [dense_results.result(), keyword_results.result()]
+    return reciprocal_rank_fusion(result_lists, config.retrieval_k, config.rrf_k)
+
+def batch_dense_search(vector_store, query_vectors, k):
+    # One FAISS search for all the queries, with the query normalization of FAISS.similarity_search_with_score_by_vector
+    query_vectors = np.array(query_vectors, dtype=np.float32)
+    if vector_store._normalize_L2:
+        faiss.normalize_L2(query_vectors)
+    _, indices = vector_store.index.search(query_vectors, k)
+    return [[vector_store.docstore.search(vector_store.index_to_docstore_id[i]) for i in row if i != -1] for row in indices]
+
+def retrieve_documents_batch(vector_store, user_queries, query_vectors):
+    """
+    Retrieves the config.retrieval_k most relevant chunks for every query, like retrieve_documents,
+    with a single FAISS search for all the queries.
+
+    Returns (list): One list of Documents per query.
+    """
+    if not config.hybrid_search:
+        return batch_dense_search(vector_store, query_vectors, config.retrieval_k)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # The keyword searches run while FAISS searches
+        keyword_results = executor.submit(lambda: [keyword_search(vector_store, query, config.hybrid_candidates) for query in user_queries])
+        dense_results = batch_dense_search(vector_store, query_vectors, config.hybrid_candidates)
+        result_lists = zip(dense_results, keyword_results.result())
+    return [reciprocal_rank_fusion(results, config.retrieval_k, config.rrf_k) for results in result_lists]
+
+def stream_generate(llm, prompt, on_token=None):
+    """
+    Generates the answer with llm.stream and passes every token to on_token as soon as it arrives.
+
+    Returns (tuple): The answer text, the time to the first token and the time from the first to the last token, in seconds.
+    """
+    start_time = time.perf_counter()
+    first_token_time = None
+    tokens = []
+    for chunk in llm.stream(prompt):
+        # LLMs stream strings, chat models stream message chunks
+        token = chunk if isinstance(chunk, str) else chunk.content
+        if not token:
+            continue
+        if first_token_time is None:
+            first_token_time = time.perf_counter()
+        tokens.append(token)
+        if on_token is not None:
+            on_token(token)
+
+    end_time = time.perf_counter()
+    first_token_time = first_token_time or end_time
+    return ''.join(tokens), first_token_time - start_time, end_time - first_token_time
+
+def build_context(relevant_docs):
+    """
+    Packs the retrieved chunks into config.context_max_tokens tokens, see context_packing.py.
+
+    Returns (tuple): The context to put in front of the question and the token counts of pack_context.
+    """
+    context, stats = pack_context(relevant_docs, config.context_max_tokens)
+    return (context + "\n\n" if context else ""), stats
+
+def report_context(stats):
+    saved = stats['overlap'] + stats['over_budget']
+    print(f"Context: {stats['context']} tokens, {saved} of the {stats['retrieved']} retrieved tokens saved "
+          f"({stats['overlap']} overlapping, {stats['over_budget']} over the {config.context_max_tokens} token budget)")
+
+def retrieve_context(vector_store, user_query, search_filter=None, query_vector=None):
+    relevant_docs = retrieve_documents(vector_store, user_query, search_filter, query_vector)
 
     # Combine the context with the user query
-    context = " ".join(doc.page_content for doc in relevant_docs)
+    context, stats = build_context(relevant_docs)
+    report_context(stats)
+    return context
+
+def query_llm(llm, vector_store, user_query):
+    context = retrieve_context(vector_store, user_query)
     response = llm.generate([context + user_query])
     return response
 
-def format_text(raw_text):
-    # Replace escaped newlines with actual newlines
-    formatted_text = raw_text.replace('\\n', '\n')
-    
-    # Convert HTML entities back to their respective characters
-    formatted_text = html.unescape(formatted_text)
-    
-    # Remove excessive whitespace while preserving line breaks
-    formatted_text = re.sub(r'\s+', ' ', formatted_text).strip()
-    
-    # Split by lines and clean each line
-    formatted_text = '\n'.join(line.strip() for line in formatted_text.splitlines())
-    
-    return formatted_text
-
-def write_answers_to_folder(user_query, raw_text):
+class QuerySession():
+    """
+    Keeps the embedding model, the vector store and the LLM client loaded across questions.
+
+    The vector store is only reloaded when the index files on disk change (e.g. after
+    create_vector_db rebuilt them). The latency of the last question is kept in last_timings,
+    split into retrieval and generation, and with config.stream_generation the time to the
+    first token and the generation speed in tokens/s.
+
+    With config.use_answer_cache, questions similar to one answered before (see AnswerCache) on the same vector
+    database are answered from the AnswerCache, without retrieval and generation. The generation info
+    of a cached answer holds the cached question and its similarity.
+    """
+    INDEX_FILES = ('index.faiss', CHUNK_STORE_FILE, 'index.pkl')
+
+    def __init__(self, vector_db_path=None):
+        self.vector_db_path = vector_db_path or config.vector_db_path
+        self.llm = load_llm()
+        self.embeddings = HuggingFaceEmbeddings()
+        self.vector_store = None
+        self.index_signature = None
+        self.last_timings = {}
+        self.answer_cache = None
+        if config.use_answer_cache:
+            self.answer_cache = AnswerCache(
+                config.answer_cache_path, self.embeddings.model_name, threshold=config.answer_cache_threshold,
+                ttl=config.answer_cache_ttl, max_entries=config.answer_cache_max_entries
+            )
+
+    def get_index_signature(self):
+        signature = []
+        for file_name in self.INDEX_FILES:
+            file_path = os.path.join(self.vector_db_path, file_name)
+            if not os.path.exists(file_path):
+                continue
+            stat = os.stat(file_path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def get_vector_store(self):
+        index_signature = self.get_index_signature()
+        if self.vector_store is None or index_signature != self.index_signature:
+            print(f"Loading vector database from {self.vector_db_path}...")
+            self.vector_store = load_vector_store(self.embeddings, self.vector_db_path)
+            self.index_signature = index_signature
+        return self.vector_store
+
+    def query(self, user_query, search_filter=None, on_token=None):
+        """
+        Answers a question. on_token is called with the tokens of the answer as they are generated
+        (with the whole answer at once for cached answers or without config.stream_generation).
+
+        Returns (LLMResult): The response, with the answer text in generations[0][0].text.
+        """
+        start_time = time.perf_counter()
+        vector_store = self.get_vector_store()
+        query_vector = self.embeddings.embed_query(user_query)
+
+        if self.answer_cache is not None:
+            self.answer_cache.set_index_version(str(self.index_signature))
+            cached = self.answer_cache.get(query_vector, user_query, search_filter)
+            if cached is not None:
+                print(f"Answer cache hit (similarity {cached['similarity']:.3f} with \"{cached['query']}\"), saved {cached['duration']:.1f}s")
+                self.answer_cache.report()
+                self.last_timings = {'retrieval': 0.0, 'generation': 0.0}
+                if on_token is not None:
+                    on_token(cached['answer'])
+                generation_info = {'cached': True, 'cached_query': cached['query'], 'similarity': cached['similarity']}
+                return LLMResult(generations=[[Generation(text=cached['answer'], generation_info=generation_info)]])
+
+        context = retrieve_context(vector_store, user_query, search_filter, query_vector)
+        retrieval_time = time.perf_counter()
+
+        if config.stream_generation:
+            answer, first_token_delay, decode_time = stream_generate(self.llm, context + user_query, on_token)
+            response = LLMResult(generations=[[Generation(text=answer)]])
+        else:
+            response = self.llm.generate([context + user_query])
+            answer = response.generations[0][0].text
+            if on_token is not None:
+                on_token(answer)
+        generation_time = time.perf_counter()
+
+        self.last_timings = {
+            'retrieval': retrieval_time - start_time,
+            'generation': generation_time - retrieval_time,
+        }
+        timings = f"Retrieval: {self.last_timings['retrieval']:.3f}s, generation: {self.last_timings['generation']:.3f}s"
+        if config.stream_generation:
+            # Time to first token as seen by the user (retrieval included), speed in tokens of the answer (see token_counting.py)
+            num_tokens = len(get_encoding().encode_ordinary(answer))
+            self.last_timings['time_to_first_token'] = retrieval_time - start_time + first_token_delay
+            self.last_timings['tokens_per_second'] = num_tokens / decode_time if decode_time > 0 else 0.0
+            timings += f", time to first token: {self.last_timings['time_to_first_token']:.3f}s, {self.last_timings['tokens_per_second']:.1f} tokens/s"
+        print(f"\n{timings}")
+
+        if self.answer_cache is not None:
+            self.answer_cache.put(query_vector, user_query, answer, generation_time - start_time, search_filter)
+            self.answer_cache.save()
+            self.answer_cache.report()
+        return response
+
+    def query_batch(self, user_queries, max_workers=None, on_result=None):
+        """
+        Answers a list of questions: they are embedded in one batch, retrieved with one multi-query
+        FAISS search and the LLM calls run concurrently, at most max_workers (config.batch_llm_workers) at a time.
+        Questions found in the answer cache are not retrieved nor generated. A failed LLM call only fails its question.
+
+        Args:
+        on_result (callable): Called with every result as soon as its answer is complete (in completion order).
+
+        Returns (list): One dict per question, in input order, holding its index, the question, the answer text,
+        the LLM response (None for cached and failed answers), the generation time, whether the answer was cached,
+        the cached question it was taken from and the error of a failed question (None otherwise).
+        """
+        start_time = time.perf_counter()
+        vector_store = self.get_vector_store()
+        query_vectors = np.asarray(self.embeddings.embed_documents(user_queries), dtype=np.float32)
+
+        results = [None] * len(user_queries)
+        if self.answer_cache is not None:
+            self.answer_cache.set_index_version(str(self.index_signature))
+            for i, query_vector in enumerate(query_vectors):
+                cached = self.answer_cache.get(query_vector, user_queries[i])
+                if cached is not None:
+                    results[i] = {'index': i, 'question': user_queries[i], 'answer': cached['answer'], 'response': None, 'generation_time': 0.0, 'cached': True, 'cached_query': cached['query'], 'error': None}
+                    if on_result is not None:
+                        on_result(results[i])
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        relevant_docs = retrieve_documents_batch(vector_store, [user_queries[i] for i in pending], query_vectors[pending]) if pending else []
+        retrieval_time = time.perf_counter()
+
+        def generate(prompt):
+            generation_start = time.perf_counter()
+            response = self.llm.generate([prompt])
+            return response, time.perf_counter() - generation_start
+
+        retrieved_tokens, context_tokens, saved_tokens = 0, 0, 0
+        with ThreadPoolExecutor(max_workers=max_workers or config.batch_llm_workers) as executor:
+            futures = {}
+            for i, docs in zip(pending, relevant_docs):
+                context, stats = build_context(docs)
+                retrieved_tokens += stats['retrieved']
+                context_tokens += stats['context']
+                saved_tokens += stats['overlap'] + stats['over_budget']
+                futures[executor.submit(generate, context + user_queries[i])] = i
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    response, generation_time = future.result()
+                except Exception as e:
+                    print(f"Question {i + 1} failed: {e}")
+                    results[i] = {'index': i, 'question': user_queries[i], 'answer': None, 'response': None, 'generation_time': 0.0, 'cached': False, 'cached_query': None, 'error': str(e)}
+                else:
+                    answer = response.generations[0][0].text
+                    results[i] = {'index': i, 'question': user_queries[i], 'answer': answer, 'response': response, 'generation_time': generation_time, 'cached': False, 'cached_query': None, 'error': None}
+                    if self.answer_cache is not None:
+                        self.answer_cache.put(query_vectors[i], user_queries[i], answer, generation_time)
+                if on_result is not None:
+                    on_result(results[i])
+
+        total_time = time.perf_counter() - start_time
+        self.last_timings = {'retrieval': retrieval_time - start_time, 'generation': total_time - (retrieval_time - start_time)}
+        if self.answer_cache is not None:
+            self.answer_cache.save()
+            self.answer_cache.report()
+
+        generation_times = [result['generation_time'] for result in results if not result['cached'] and result['error'] is None]
+        failed = sum(result['error'] is not None for result in results)
+        if failed:
+            print(f"{failed} of {len(user_queries)} questions failed.")
+        mean_generation = sum(generation_times) / len(generation_times) if generation_times else 0
+        print(f"Answered {len(user_queries)} questions in {total_time:.2f}s ({len(user_queries) / total_time:.2f} questions/s): "
+              f"retrieval {self.last_timings['retrieval']:.3f}s, mean generation {mean_generation:.2f}s per question")
+        print(f"Context: {context_tokens} tokens, {saved_tokens} of the {retrieved_tokens} retrieved tokens saved")
+        return results
+
+def get_answer_path(user_query):
     # Create the 'answers' directory if it doesn't exist
     answers_folder = 'answers'
     os.makedirs(answers_folder, exist_ok=True)
 
-    print(raw_text)
-    # Extract the relevant text from the raw input
-    match = re.search(r"text='(.*?)'", raw_text, re.DOTALL)
-    if match:
-        extracted_text = match.group(1).strip()
-    else:
-        print("No text found in the input.")
-        return
-
-    # Format the extracted text for readability
-    formatted_text = format_text(extracted_text)
-
     # Create the filename using the user_query
-    file_name = f"{user_query}.txt"
+    return os.path.join(answers_folder, f"{user_query}.txt")
+
+def cached_answer_note(cached_query):
+    # Marks an answer taken from the answer cache, with the question it was generated for
+    return f"\n\n(Cached answer, generated for the question \"{cached_query}\")"
 
-    # Write the formatted text to the file
-    file_path = os.path.join(answers_folder, file_name)
+def write_answers_to_folder(user_query, answer_text, cached_query=None):
+    # The answer text is taken from the generations of the LLM response, no need to parse its string form
+    file_path = get_answer_path(user_query)
     with open(file_path, 'w', encoding='utf-8') as file:
-        file.write(formatted_text)
+        file.write(answer_text.strip())
+        if cached_query is not None:
+            file.write(cached_answer_note(cached_query))
 
     print(f"Answers written to {file_path}")
 
 
+def read_questions(questions_file):
+    # One question per line, or a JSONL file of {"question": ...} objects
+    with open(questions_file, 'r', encoding='utf-8') as file:
+        lines = [line.strip() for line in file if line.strip()]
+    if questions_file.endswith('.jsonl'):
+        return [json.loads(line)['question'] for line in lines]
+    return lines
+
+def batch_main(questions_file, output_file=None, session=None):
+    """
+    Answers every question of questions_file. Every answer is written as soon as it is complete: to output_file
+    when it is a .jsonl file (one record per question, in completion order, with the error of failed questions
+    and the cached question of cached answers), otherwise to one file per question in the answers folder.
+    """
+    if session is None:
+        session = QuerySession()
+
+    questions = read_questions(questions_file)
+    print(f"Answering {len(questions)} questions from {questions_file}...")
+
+    if output_file and output_file.endswith('.jsonl'):
+        with open(output_file, 'w', encoding='utf-8') as file:
+            def write_record(result):
+                record = {key: result[key] for key in ('index', 'question', 'answer', 'generation_time', 'cached', 'cached_query', 'error')}
+                file.write(json.dumps(record) + '\n')
+                file.flush()
+
+            results = session.query_batch(questions, on_result=write_record)
+        print(f"Answers written to {output_file}")
+    else:
+        def write_answer(result):
+            if result['error'] is None:
+                write_answers_to_folder(result['question'], result['answer'], result['cached_query'])
+
+        results = session.query_batch(questions, on_result=write_answer)
+    return results
+
 # Main function to run the program
-def main():
+def main(session=None):
+    # Pass a QuerySession to reuse the loaded models and index across questions
+    if session is None:
+        session = QuerySession()
+
     user_query = input("Ask a question: \n")
-    llm = load_llm()
-    embeddings = HuggingFaceEmbeddings()
-    vector_store = FAISS.load_local("vector_database", embeddings, allow_dangerous_deserialization=True)
-    answer = query_llm(llm, vector_store, user_query)
-    # print("Answer:", answer)
-    write_answers_to_folder(user_query, str(answer))
+    file_path = get_answer_path(user_query)
+
+    # Print and write the answer while it is generated
+    with open(file_path, 'w', encoding='utf-8') as answer_file:
+        def write_token(token):
+            print(token, end='', flush=True)
+            answer_file.write(token)
+            answer_file.flush()
+
+        response = session.query(user_query, on_token=write_token)
+        generation_info = response.generations[0][0].generation_info or {}
+        if generation_info.get('cached'):
+            write_token(cached_answer_note(generation_info['cached_query']))
+    print(f"\nAnswers written to {file_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python prompt_llm.py <questions file> [answers.jsonl] answers a file of questions, without arguments a single question is asked
+    if len(sys.argv) > 1:
+        batch_main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,117 @@
+from generic_functions import escape_xml
+
+
+def parse_diff(diff_text):
+    """
+    Parses a unified git diff into files and hunks in one pass.
+
+    Args:
+    diff_text (str): The diff of a pull request, as served by its diff_url.
+
+    Returns (list): One dict per file holding its path, its header lines (diff --git, index, ---, +++)
+    and its hunks. A hunk holds its @@ header line and its lines. Lines before the first file
+    (if any) are kept as a file without path.
+    """
+    files = [{'path': None, 'header': [], 'hunks': []}]
+    for line in diff_text.split("\n"):
+        current = files[-1]
+        if line.startswith("diff --git "):
+            # diff --git a/<path> b/<path>, the +++ line below gives the exact new path
+            files.append({'path': line.split(" b/", 1)[-1], 'header': [line], 'hunks': []})
+        elif line.startswith("@@") and current['path'] is not None:
+            current['hunks'].append({'header': line, 'lines': []})
+        elif current['hunks']:
+            current['hunks'][-1]['lines'].append(line)
+        else:
+            if line.startswith("+++ b/"):
+                current['path'] = line[len("+++ b/"):]
+            current['header'].append(line)
+    return files
+
+
+def index_comments(comments):
+    """
+    Indexes review comments on the diff line they were left on.
+
+    Returns (tuple): A dict of path to a dict of position to the comments on that line (in the order given),
+    and the list of comments without a position (PR-level comments and outdated review comments).
+    """
+    comments_by_position = {}
+    other_comments = []
+    for comment in comments:
+        position = comment.get("position")
+        if comment.get("path") is None or position is None:
+            other_comments.append(comment)
+        else:
+            comments_by_position.setdefault(comment["path"], {}).setdefault(position, []).append(comment)
+    return comments_by_position, other_comments
+
+
+def render_review_comment(comment):
+    # Comment element
+    """
+    <review_comment>
+        <author>xxx</author>
+        <content>xxx</content>
+        <path>xxx</path>
+        <line>xxx</line>
+    </review_comment>
+    """
+    if comment.get("path") is None:
+        # PR-level comment
+        return (
+            '<review_comment>\n'
+            f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
+            f'<content>{escape_xml(comment["body"])}</content>\n'
+            '</review_comment>\n'
+        )
+    return (
+        '<review_comment>\n'
+        f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
+        f'<content>{escape_xml(comment["body"])}</content>\n'
+        f'<path>{escape_xml(comment["path"])}</path>\n'
+        f'<line>{comment.get("original_line")}</line>\n'
+        '</review_comment>\n'
+    )
+
+
+def iter_diff_and_comments(diff_text, comments):
+    """
+    Merges the diff and the comments of a pull request in a single pass over the diff.
+
+    Review comments follow the diff line they were left on. Their GitHub position counts the lines
+    below the first @@ header of their file, through the following hunks. Comments without a position
+    follow the diff.
+
+    Yields (str): Blocks of escaped diff lines and the comment elements, in output order.
+    """
+    comments_by_position, other_comments = index_comments(comments)
+
+    for diff_file in parse_diff(diff_text):
+        file_comments = comments_by_position.get(diff_file['path'], {})
+        commented_positions = sorted(file_comments)
+        # Lines are escaped in blocks running up to the next commented line
+        block = list(diff_file['header'])
+        hunk_position = 0
+        for hunk in diff_file['hunks']:
+            hunk_lines = [hunk['header']] + hunk['lines']
+            next_position = hunk_position + len(hunk_lines)
+            start = 0
+            while commented_positions and commented_positions[0] < next_position:
+                position = commented_positions.pop(0)
+                if position < hunk_position:
+                    # Position outside of the diff
+                    other_comments.extend(file_comments[position])
+                    continue
+                end = position - hunk_position + 1
+                yield escape_xml('\n'.join(block + hunk_lines[start:end])) + '\n'
+                yield ''.join(render_review_comment(comment) for comment in file_comments[position])
+                block, start = [], end
+            block.extend(hunk_lines[start:])
+            hunk_position = next_position
+        other_comments.extend(comment for position in commented_positions for comment in file_comments[position])
+        if block:
+            yield escape_xml('\n'.join(block)) + '\n'
+
+    for comment in other_comments:
+        yield render_review_comment(comment)
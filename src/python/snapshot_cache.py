@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+
+class SnapshotCache():
+    """
+    On-disk cache of flattened repositories, keyed by repository, resolved commit SHA and filter settings.
+
+    Every snapshot holds both the uncompressed and the compressed output, so a cache hit skips the
+    flattening and the compression step, along with the token counts of both outputs. Snapshots are evicted least-recently-used first once the
+    cache grows beyond max_bytes.
+    """
+    UNCOMPRESSED_FILE = 'uncompressed_output.txt'
+    COMPRESSED_FILE = 'compressed_output.txt'
+    TOKEN_COUNTS_FILE = 'token_counts.json'
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(owner, repo, commit_sha, filter_settings):
+        key_data = json.dumps([owner, repo, commit_sha, filter_settings], sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def restore(self, key, output_file, processed_file):
+        """
+        Copies the cached snapshot to the output files.
+
+        Returns (bool): True on a cache hit, False if the snapshot is not cached.
+        """
+        snapshot_path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(snapshot_path):
+            return False
+
+        shutil.copyfile(os.path.join(snapshot_path, self.UNCOMPRESSED_FILE), output_file)
+        shutil.copyfile(os.path.join(snapshot_path, self.COMPRESSED_FILE), processed_file)
+        # The modification time of the snapshot folder tracks when it was last used
+        os.utime(snapshot_path)
+        return True
+
+    def load_token_counts(self, key):
+        """
+        Returns (tuple): The token counts of the uncompressed and the compressed output of the snapshot,
+        as returned by TextFileMethods.parse_text_as_xml, or None if the snapshot has none.
+        """
+        token_counts_path = os.path.join(self.cache_dir, key, self.TOKEN_COUNTS_FILE)
+        if not os.path.exists(token_counts_path):
+            return None
+        with open(token_counts_path, 'r', encoding='utf-8') as file:
+            return tuple(tuple(counts) for counts in json.load(file))
+
+    def store(self, key, output_file, processed_file, token_counts=None):
+        snapshot_path = os.path.join(self.cache_dir, key)
+        temp_path = snapshot_path + '.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        shutil.copyfile(output_file, os.path.join(temp_path, self.UNCOMPRESSED_FILE))
+        shutil.copyfile(processed_file, os.path.join(temp_path, self.COMPRESSED_FILE))
+        if token_counts is not None:
+            with open(os.path.join(temp_path, self.TOKEN_COUNTS_FILE), 'w', encoding='utf-8') as file:
+                json.dump(token_counts, file)
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        os.replace(temp_path, snapshot_path)
+        self.evict()
+
+    def evict(self):
+        snapshots = []
+        for name in os.listdir(self.cache_dir):
+            snapshot_path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(snapshot_path) or name.endswith('.tmp'):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(snapshot_path))
+            snapshots.append((os.path.getmtime(snapshot_path), size, snapshot_path))
+
+        total_size = sum(size for _, size, _ in snapshots)
+        for _, size, snapshot_path in sorted(snapshots):
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(snapshot_path, ignore_errors=True)
+            total_size -= size
+
+
+class ETagStore():
+    """
+    Persists the ETag and body of GitHub metadata responses, so they can be re-requested
+    with If-None-Match. A 304 Not Modified answer does not count against the rate limit.
+
+    Several stores (e.g. the inputs of create_text_file's batch mode) can share one file: every save
+    merges the entries saved by the others, the most recent entry of a URL wins.
+    """
+    # Serializes the saves of the stores of this process
+    save_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def put(self, url, etag, body):
+        self.entries[url] = {'etag': etag, 'body': body, 'time': time.time()}
+
+    def save(self):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with self.save_lock:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    saved_entries = json.load(file)
+                for url, entry in saved_entries.items():
+                    if url not in self.entries or self.entries[url]['time'] < entry['time']:
+                        self.entries[url] = entry
+
+            # A temporary file of its own, other processes may be saving to the same path
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix='.tmp', delete=False) as file:
+                json.dump(self.entries, file)
+            os.replace(file.name, self.path)
@@ -0,0 +1,220 @@
+import os
+import re
+from functools import lru_cache
+
+import tiktoken
+
+ENCODING_NAME = "cl100k_base"
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+SOURCE_TAG_PATTERN = re.compile(r'<source type="([^"]*)" (?:path|url|identifier)="([^"]*)">')
+FILE_TAG_PATTERN = re.compile(r'<file name="([^"]*)">')
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name=ENCODING_NAME):
+    # Loading an encoding reads (and possibly downloads) its BPE ranks, so it is only done once per process
+    return tiktoken.get_encoding(encoding_name)
+
+
+def split_on_elements(text):
+    """
+    Removes the XML tags from the text and splits the result on the <source> and <file> elements.
+
+    Pieces only start right after a new-line and on a non-whitespace character. tiktoken never
+    merges text across such a boundary, so the token counts of the pieces add up exactly
+    to the token count of the whole text without tags.
+
+    Args:
+    text (str): Flattened text, as written by create_text_file.
+
+    Returns (list): Tuples of (label, piece). The label is the file name, or the source for text outside of files.
+    """
+    stripped_parts = []
+    boundaries = [(0, '')]
+    stripped_length = 0
+    position = 0
+    source_label = ''
+
+    for match in TAG_PATTERN.finditer(text):
+        segment = text[position:match.start()]
+        stripped_parts.append(segment)
+        stripped_length += len(segment)
+        position = match.end()
+
+        tag = match.group(0)
+        source_match = SOURCE_TAG_PATTERN.fullmatch(tag)
+        file_match = FILE_TAG_PATTERN.fullmatch(tag)
+        if source_match:
+            source_label = f"{source_match.group(1)}: {source_match.group(2)}"
+            boundaries.append((stripped_length, source_label))
+        elif file_match:
+            boundaries.append((stripped_length, file_match.group(1)))
+        elif tag == '</file>':
+            boundaries.append((stripped_length, source_label))
+    stripped_parts.append(text[position:])
+    stripped_text = ''.join(stripped_parts)
+
+    # Move every boundary past the leading whitespace of its piece and drop the unsafe ones
+    safe_boundaries = [(0, boundaries[0][1])]
+    for start, label in boundaries[1:]:
+        while start < len(stripped_text) and stripped_text[start].isspace():
+            start += 1
+        if start >= len(stripped_text) or (start > 0 and stripped_text[start - 1] not in '\r\n'):
+            continue
+        if start == safe_boundaries[-1][0]:
+            safe_boundaries[-1] = (start, label)
+        else:
+            safe_boundaries.append((start, label))
+
+    ends = [start for start, _ in safe_boundaries[1:]] + [len(stripped_text)]
+    return [(label, stripped_text[start:end]) for (start, label), end in zip(safe_boundaries, ends)]
+
+
+def count_tokens(text, encoding_name=ENCODING_NAME, num_threads=None):
+    """
+    Counts the tokens of the text without XML tags, per <file> element and in total.
+
+    The pieces are encoded in parallel with tiktoken's batch encoder when more than one thread is available.
+
+    Returns (tuple): The total token count and a dict of label to token count, in document order.
+    """
+    encoding = get_encoding(encoding_name)
+    pieces = split_on_elements(text)
+    num_threads = min(num_threads or os.cpu_count() or 1, len(pieces))
+    if num_threads > 1:
+        token_lists = encoding.encode_ordinary_batch([piece for _, piece in pieces], num_threads=num_threads)
+    else:
+        token_lists = [encoding.encode_ordinary(piece) for _, piece in pieces]
+
+    token_table = {}
+    for (label, _), tokens in zip(pieces, token_lists):
+        token_table[label] = token_table.get(label, 0) + len(tokens)
+    return sum(token_table.values()), token_table
+
+
+def find_safe_cut(text):
+    # Last position right after a new-line and on a non-whitespace character (see split_on_elements), 0 if there is none
+    position = len(text) - 1
+    while position > 0:
+        position = max(text.rfind('\n', 0, position), text.rfind('\r', 0, position))
+        if position < 0:
+            return 0
+        if not text[position + 1].isspace():
+            return position + 1
+    return 0
+
+
+class TokenCounter():
+    """
+    Counts the tokens of a flattened text that is fed piece by piece (while it is read or written),
+    with the same result as count_tokens on the whole text.
+
+    The text is stripped of its XML tags as it comes in, and every feed encodes the text up to the last
+    safe boundary (see split_on_elements), so only the text after it is held in memory.
+    """
+    def __init__(self, encoding_name=ENCODING_NAME):
+        self.encoding = get_encoding(encoding_name)
+        self.token_table = {}
+        # Start of an unfinished tag, completed by the next feed
+        self.raw_tail = ''
+        # Text without tags that is not counted yet, the label of its start and the <source>/<file> boundaries in it
+        self.pending = ''
+        self.label = ''
+        self.boundaries = []
+        self.source_label = ''
+
+    def feed(self, text):
+        text = self.raw_tail + text
+        # A < after the last > starts a tag that ends in a later piece
+        tag_start = text.find('<', text.rfind('>') + 1)
+        if tag_start >= 0:
+            text, self.raw_tail = text[:tag_start], text[tag_start:]
+        else:
+            self.raw_tail = ''
+        self.add_text(text)
+        self.flush(find_safe_cut(self.pending))
+
+    def add_text(self, text):
+        parts = [self.pending]
+        length = len(self.pending)
+        position = 0
+        for match in TAG_PATTERN.finditer(text):
+            segment = text[position:match.start()]
+            parts.append(segment)
+            length += len(segment)
+            position = match.end()
+
+            tag = match.group(0)
+            source_match = SOURCE_TAG_PATTERN.fullmatch(tag)
+            file_match = FILE_TAG_PATTERN.fullmatch(tag)
+            if source_match:
+                self.source_label = f"{source_match.group(1)}: {source_match.group(2)}"
+                self.boundaries.append((length, self.source_label))
+            elif file_match:
+                self.boundaries.append((length, file_match.group(1)))
+            elif tag == '</file>':
+                self.boundaries.append((length, self.source_label))
+        parts.append(text[position:])
+        self.pending = ''.join(parts)
+
+    def flush(self, cut, final=False):
+        """
+        Counts the pending text up to cut, a safe boundary (or its end once the text is complete).
+
+        The boundaries before cut are placed the way split_on_elements places them: past the leading
+        whitespace of their piece, and dropped unless they follow a new-line. The text before
+        the pending text ends on a new-line, so a boundary at its start is always kept.
+        """
+        if cut <= 0 and not final:
+            return
+        pieces = [(0, self.label)]
+        remaining = []
+        for offset, label in self.boundaries:
+            if offset > cut:
+                remaining.append((offset - cut, label))
+                continue
+            start = offset
+            while start < len(self.pending) and self.pending[start].isspace():
+                start += 1
+            if start >= len(self.pending) or (start > 0 and self.pending[start - 1] not in '\r\n'):
+                continue
+            if start == pieces[-1][0]:
+                pieces[-1] = (start, label)
+            else:
+                pieces.append((start, label))
+
+        # A boundary placed at the cut gives the label of the text after it
+        if not final and pieces[-1][0] == cut:
+            self.label = pieces.pop()[1]
+        elif not final:
+            self.label = pieces[-1][1]
+        ends = [start for start, _ in pieces[1:]] + [cut]
+        texts = [self.pending[start:end] for (start, _), end in zip(pieces, ends)]
+        token_lists = self.encoding.encode_ordinary_batch(texts) if len(texts) > 1 else [self.encoding.encode_ordinary(texts[0])]
+        for (_, label), text, tokens in zip(pieces, texts, token_lists):
+            # Only an empty text has an empty piece, count_tokens still lists its label
+            if text or not self.token_table:
+                self.token_table[label] = self.token_table.get(label, 0) + len(tokens)
+        self.pending = self.pending[cut:]
+        self.boundaries = remaining
+
+    def count(self):
+        """
+        Counts the rest of the text, once it is complete.
+
+        Returns (tuple): The total token count and a dict of label to token count, in document order, like count_tokens.
+        """
+        self.add_text(self.raw_tail)
+        self.raw_tail = ''
+        self.flush(len(self.pending), final=True)
+        return sum(self.token_table.values()), self.token_table
+
+
+def count_file_tokens(file_path, chunk_size=1024 * 1024):
+    # Token counts of a flattened file (see count_tokens), read in chunks
+    counter = TokenCounter()
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        for chunk in iter(lambda: file.read(chunk_size), ''):
+            counter.feed(chunk)
+    return counter.count()